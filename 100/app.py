@@ -14,6 +14,8 @@ from mksdk import MkSLocalHWConnector
 from mksdk import MkSUSBAdaptor
 from mksdk import MkSProtocol
 
+from mkscommon import MkSNodeCommands
+
 from flask import Response, request
 
 class Context():
@@ -28,6 +30,10 @@ class Context():
 		self.Handlers					= {
 			'undefined':				self.UndefindHandler
 		}
+		self.CustomRequestHandlers		= {
+		}
+		# Measured handlers, get_node_metrics and the dispatcher pool for slow handlers
+		self.Commands 					= MkSNodeCommands.NodeCommands(self.Node, self.Handlers, self.CustomRequestHandlers)
 
 	def UndefindHandler(self, message_type, source, data):
 		print "UndefindHandler"
@@ -75,6 +81,10 @@ class Context():
 	def OnSetSensorInfoRequestHandler(self, packet, sock):
 		print "OnSetSensorInfoRequestHandler"
 
+	def OnCustomCommandRequestHandler(self, sock, json_data):
+		print "OnCustomCommandRequestHandler", json_data['command']
+		self.Commands.Dispatch(sock, json_data)
+
 	def GetNodeInfoHandler(self, key):
 		return json.dumps({
 			'response':'OK'
@@ -138,6 +148,7 @@ def main():
 	THIS.Node.LocalServiceNode.OnTerminateConnectionCallback 		= THIS.OnTerminateConnectionHandler
 	THIS.Node.LocalServiceNode.OnGetSensorInfoRequestCallback 		= THIS.OnGetSensorInfoRequestHandler
 	THIS.Node.LocalServiceNode.OnSetSensorInfoRequestCallback 		= THIS.OnSetSensorInfoRequestHandler
+	THIS.Node.LocalServiceNode.OnCustomCommandRequestCallback		= THIS.OnCustomCommandRequestHandler
 	
 	THIS.Node.Run(THIS.WorkingHandler)
 	print "Exit Node ..."
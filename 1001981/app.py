@@ -6,6 +6,7 @@ import json
 import time
 import thread
 import threading
+import logging
 if sys.platform in ["win32"]:
 	import Queue as queue
 else:
@@ -27,6 +28,9 @@ from mksdk import MkSUSBAdaptor
 from mksdk import MkSProtocol
 from mksdk import MkSExternalProcess
 
+from mkscommon import MkSNodeCommands
+from mkscommon import MkSLogger
+
 from flask import Response, request
 
 class FileUpload():
@@ -72,6 +76,8 @@ class FileUpload():
 		return data, len(data)
 
 
+LOG = logging.getLogger("surface")
+
 class Context():
 	def __init__(self, node):
 		self.Interval					= 10
@@ -92,6 +98,12 @@ class Context():
 			'surface_get_upload_list':				self.SurfaceGetUploadListRequestHandler,
 			'surface_dfu_fw':						self.SurfaceDfuFirmwareRequestHandler,
 		}
+		# Measured handlers, get_node_metrics and the dispatcher pool for slow handlers
+		self.Commands 							= MkSNodeCommands.NodeCommands(self.Node, self.Handlers, self.CustomRequestHandlers)
+		self.Commands.Offload('surface_fw_info', group='fw')
+		self.Commands.Offload('surface_toggle_fw', group='fw')
+		self.Commands.Offload('surface_dfu_fw', group='fw')
+		self.Commands.Offload('surface_get_upload_list')
 		self.CustomResponseHandlers				= {
 		}
 
@@ -348,10 +360,8 @@ class Context():
 			self.Locker.release()
 
 	def OnCustomCommandRequestHandler(self, sock, json_data):
-		print ("OnCustomCommandRequestHandler")
-		command = json_data['command']
-		if command in self.CustomRequestHandlers:
-			self.CustomRequestHandlers[command](sock, json_data)
+		LOG.debug("OnCustomCommandRequestHandler %s", json_data['command'])
+		self.Commands.Dispatch(sock, json_data)
 
 	def OnCustomCommandResponseHandler(self, sock, json_data):
 		print ("OnCustomCommandResponseHandler")
@@ -417,6 +427,7 @@ def signal_handler(signal, frame):
 	THIS.Node.Stop()
 
 def main():
+	MkSLogger.Setup("surface")
 	signal.signal(signal.SIGINT, signal_handler)
 	THIS.Node.SetLocalServerStatus(True)
 	
@@ -441,6 +452,7 @@ def main():
 	THIS.Node.LocalServiceNode.OnCustomCommandResponseCallback		= THIS.OnCustomCommandResponseHandler
 
 	THIS.Node.Run(THIS.WorkingHandler)
+	MkSLogger.Flush()
 	print "Exit Node ..."
 
 if __name__ == "__main__":
@@ -26,8 +26,13 @@ from mksdk import MkSLocalHWConnector
 from mksdk import MkSUSBAdaptor
 from mksdk import MkSProtocol
 
+from mkscommon import MkSNodeCommands
+from mkscommon import MkSLogger
+
 from flask import Response, request
 
+LOG = logging.getLogger("email")
+
 class Context():
 	def __init__(self, node):
 		self.Interval					= 10
@@ -42,8 +47,12 @@ class Context():
 		}
 		self.CustomRequestHandlers		= {
 			'send_email_html':					self.SendEmailHtmlHandler,
-			'send_email_html_with_image':		self.SendEmailHtmlWithImageHandler
+			'send_email_html_with_image':		self.SendEmailHtmlWithImageHandler,
 		}
+		# Measured handlers, get_node_metrics and the dispatcher pool for slow handlers
+		self.Commands 							= MkSNodeCommands.NodeCommands(self.Node, self.Handlers, self.CustomRequestHandlers)
+		self.Commands.Offload('send_email_html', concurrency=2, group='smtp')
+		self.Commands.Offload('send_email_html_with_image', concurrency=2, group='smtp')
 		self.CustomResponseHandlers		= {
 		}
 		self.Orders 					= Queue.Queue()
@@ -199,10 +208,8 @@ class Context():
 		print ("OnSetSensorInfoRequestHandler")
 	
 	def OnCustomCommandRequestHandler(self, sock, json_data):
-		print ("OnCustomCommandRequestHandler")
-		command = json_data['command']
-		if command in self.CustomRequestHandlers:
-			self.CustomRequestHandlers[command](sock, json_data)
+		LOG.debug("OnCustomCommandRequestHandler %s", json_data['command'])
+		self.Commands.Dispatch(sock, json_data)
 
 	def OnCustomCommandResponseHandler(self, sock, json_data):
 		print ("OnCustomCommandResponseHandler")
@@ -253,13 +260,13 @@ class Context():
 
 	def WorkingHandler(self):
 		if time.time() - self.CurrentTimestamp > self.Interval:
-			print ("WorkingHandler")
+			LOG.debug("WorkingHandler")
 
 			self.CheckingForUpdate = True
 			self.CurrentTimestamp = time.time()
 
 			for idx, item in enumerate(THIS.Node.LocalServiceNode.GetConnections()):
-				print ("  ", str(idx), item.LocalType, item.UUID, item.IP, item.Port, item.Type)
+				LOG.debug("  %s %s %s %s %s %s", idx, item.LocalType, item.UUID, item.IP, item.Port, item.Type)
 
 Service = MkSSlaveNode.SlaveNode()
 Node 	= MkSNode.Node("EMail Service", Service)
@@ -269,6 +276,7 @@ def signal_handler(signal, frame):
 	THIS.Node.Stop()
 
 def main():
+	MkSLogger.Setup("email")
 	signal.signal(signal.SIGINT, signal_handler)
 	THIS.Node.SetLocalServerStatus(True)
 	
@@ -293,6 +301,7 @@ def main():
 	THIS.Node.LocalServiceNode.OnCustomCommandResponseCallback		= THIS.OnCustomCommandResponseHandler
 	
 	THIS.Node.Run(THIS.WorkingHandler)
+	MkSLogger.Flush()
 	print ("Exit Node ...")
 
 if __name__ == "__main__":
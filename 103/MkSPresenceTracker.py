@@ -0,0 +1,149 @@
+#!/usr/bin/python
+import time
+import threading
+from datetime import datetime
+
+from mkscommon import MkSWakeEvent
+
+class HostEntry():
+	def __init__(self, ip, mac):
+		self.IP 		= ip
+		self.MAC 		= mac
+		self.FirstSeen 	= None
+		self.LastSeen 	= None
+		self.NextProbe 	= 0
+		self.Interval 	= 0
+		self.Failures 	= 0
+		self.IsOnline 	= False
+
+class PresenceTracker():
+	def __init__(self, networks, scanner):
+		self.ObjName 			= "PresenceTracker"
+		self.Networks 			= networks
+		self.Scanner 			= scanner
+		self.ARPTablePath 		= "/proc/net/arp"
+		# Timing (seconds)
+		self.TickInterval 		= 5
+		self.MinProbeInterval 	= 30
+		self.MaxProbeInterval 	= 600
+		self.SweepInterval 		= 60 * 60
+		self.OfflineAfter 		= 2
+		self.ForgetAfter 		= 24 * 60 * 60
+		# Only the tracker thread touches Hosts
+		self.Hosts 				= {}
+		self.LastSweep 			= 0
+		# Published snapshot, replaced as a whole so readers never need a lock
+		self.OnlineDevices 		= []
+		self.IsRunning 			= False
+		self.WakeEvent 			= MkSWakeEvent.WakeEvent()
+
+	def Run(self):
+		self.IsRunning = True
+		self.WakeEvent.clear()
+		worker = threading.Thread(target=self.TrackerThread, name=self.ObjName)
+		worker.daemon = True
+		worker.start()
+
+	def Stop(self):
+		self.IsRunning = False
+		self.WakeEvent.set()
+
+	def GetOnlineDevices(self):
+		return self.OnlineDevices
+
+	def InNetworks(self, ip):
+		for network in self.Networks:
+			if ip.startswith(network):
+				return True
+		return False
+
+	# Returns {ip: (mac, is_complete)} for every neighbour in our networks.
+	def ReadARPTable(self):
+		entries = {}
+		try:
+			with open(self.ARPTablePath, "r") as arp:
+				lines = arp.readlines()
+		except IOError:
+			return entries
+
+		for line in lines[1:]:
+			cols = line.split()
+			if len(cols) < 4:
+				continue
+			ip, flags, mac = cols[0], cols[2], cols[3]
+			if self.InNetworks(ip) is False:
+				continue
+			complete = (0 != (int(flags, 16) & 0x2))
+			if complete is False:
+				mac = None
+			entries[ip] = (mac, complete)
+		return entries
+
+	def Track(self, ip, mac, now):
+		host = self.Hosts.get(ip)
+		if host is None:
+			host = HostEntry(ip, mac)
+			host.NextProbe = now
+			self.Hosts[ip] = host
+		elif mac is not None:
+			host.MAC = mac
+		return host
+
+	def Seed(self, now):
+		# Full sweep, rare. Hosts that do not answer are dropped again after one probe.
+		if now - self.LastSweep > self.SweepInterval:
+			for network in self.Networks:
+				for client in range(1, 255):
+					self.Track(network + str(client), None, now)
+			self.LastSweep = now
+
+		for ip, (mac, complete) in self.ReadARPTable().items():
+			if complete is True:
+				self.Track(ip, mac, now)
+			elif ip in self.Hosts and self.Hosts[ip].IsOnline is True:
+				# Kernel lost the neighbour, do not wait for the backoff to expire
+				self.Hosts[ip].NextProbe = now
+
+	def UpdateHost(self, host, online, now):
+		if online is True:
+			if host.FirstSeen is None:
+				host.FirstSeen = now
+			host.LastSeen 	= now
+			host.Failures 	= 0
+			host.IsOnline 	= True
+			# Stable hosts are probed less and less often
+			host.Interval 	= min(max(host.Interval * 2, self.MinProbeInterval), self.MaxProbeInterval)
+		else:
+			host.Failures += 1
+			if host.Failures >= self.OfflineAfter:
+				host.IsOnline = False
+			host.Interval 	= min(self.MinProbeInterval * (2 ** (host.Failures - 1)), self.MaxProbeInterval)
+		host.NextProbe = now + host.Interval
+
+	def Publish(self):
+		online = [host for host in self.Hosts.values() if host.IsOnline is True]
+		online.sort(key=lambda host: [int(part) for part in host.IP.split(".")])
+		self.OnlineDevices = [[	host.IP,
+								datetime.fromtimestamp(host.LastSeen).strftime('%Y-%m-%d %H:%M:%S'),
+								datetime.fromtimestamp(host.FirstSeen).strftime('%Y-%m-%d %H:%M:%S'),
+								host.MAC ] for host in online]
+
+	def TrackerThread(self):
+		while self.IsRunning is True:
+			now = time.time()
+			self.Seed(now)
+
+			due = [host for host in self.Hosts.values() if host.NextProbe <= now]
+			if len(due) > 0:
+				online = set(self.Scanner.Probe([host.IP for host in due], self.Scanner.Ping))
+				now = time.time()
+				for host in due:
+					self.UpdateHost(host, host.IP in online, now)
+					# Never answered and unknown to the kernel, or gone for too long
+					if host.FirstSeen is None and host.MAC is None:
+						del self.Hosts[host.IP]
+					elif host.IsOnline is False and host.LastSeen is not None and now - host.LastSeen > self.ForgetAfter:
+						del self.Hosts[host.IP]
+				self.Publish()
+
+			self.WakeEvent.wait(self.TickInterval)
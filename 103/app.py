@@ -7,8 +7,6 @@ import time
 import thread
 import threading
 import logging
-import subprocess
-from datetime import datetime
 
 from mksdk import MkSFile
 from mksdk import MkSNode
@@ -18,8 +16,16 @@ from mksdk import MkSUSBAdaptor
 from mksdk import MkSProtocol
 from mksdk import MkSUtils
 
+from mkscommon import MkSDeviceScanner
+from mkscommon import MkSNodeCommands
+from mkscommon import MkSLogger
+
 from flask import Response, request
 
+import MkSPresenceTracker
+
+LOG = logging.getLogger("presence")
+
 class Context():
 	def __init__(self, node):
 		self.Interval					= 10
@@ -33,16 +39,15 @@ class Context():
 			'undefined':				self.UndefindHandler
 		}
 		self.CustomRequestHandlers		= {
-			'get_online_devices':		self.GetOnlineDevicesHandler
+			'get_online_devices':		self.GetOnlineDevicesHandler,
 		}
+		# Measured handlers, get_node_metrics and the dispatcher pool for slow handlers
+		self.Commands 							= MkSNodeCommands.NodeCommands(self.Node, self.Handlers, self.CustomRequestHandlers)
 		self.CustomResponseHandlers		= {
 		}
 
 		# TODO - Find these networks automaticaly
 		self.Networks					= []
-		self.OnlineDevices 				= {}
-		self.ThreadWorking 				= True
-		self.ThreadLock					= threading.Lock()
 		
 		self.Utilities = MkSUtils.Utils()
 		items = self.Utilities.GetSystemIPs()
@@ -51,35 +56,9 @@ class Context():
 				net = ".".join(item[0].split('.')[0:-1]) + '.'
 				self.Networks.append(net)
 
-		for network in self.Networks:
-			thread.start_new_thread(self.PingDevicesThread, (network, range(1,100), ))
-			thread.start_new_thread(self.PingDevicesThread, (network, range(101,200), ))
-	
-	def Ping(self, address):
-		response = subprocess.call("ping -c 1 %s" % address,
-				shell=True,
-				stdout=open('/dev/null', 'w'),
-				stderr=subprocess.STDOUT)
-		# Check response
-		if response == 0:
-			return True
-		else:
-			return False
-
-	def PingDevicesThread(self, network, range):
-		while (self.ThreadWorking is True):
-			for client in range:
-				if (self.ThreadWorking is False):
-					return
-				ip = network + str(client)
-				res = self.Ping(ip)
-				self.ThreadLock.acquire()
-				if (res is True):
-					print(ip, "ONLINE")
-					self.OnlineDevices[ip] = [ip, datetime.now().strftime('%Y-%m-%d %H:%M:%S')]
-				else:
-					print(ip, "OFFLINE")
-				self.ThreadLock.release()
+		self.DeviceScanner				= MkSDeviceScanner.DeviceScanner()
+		self.Presence 					= MkSPresenceTracker.PresenceTracker(self.Networks, self.DeviceScanner)
+		self.Presence.Run()
 
 	def UndefindHandler(self, message_type, source, data):
 		print ("UndefindHandler")
@@ -105,11 +84,9 @@ class Context():
 	# }
 	
 	def GetOnlineDevicesHandler(self, sock, packet):
-		print ("GetOnlineDevicesHandler", packet, self.OnlineDevices)
-		
-		listOfDevice = []
-		for key in self.OnlineDevices:
-			listOfDevice.append(self.OnlineDevices[key])
+		print ("GetOnlineDevicesHandler")
+		# Snapshot is published by the tracker thread, no lock needed
+		listOfDevice = self.Presence.GetOnlineDevices()
 
 		THIS.Node.LocalServiceNode.SendCustomCommandResponse(sock, packet, {
 			'online_devices': listOfDevice
@@ -157,10 +134,8 @@ class Context():
 		print ("OnSetSensorInfoRequestHandler")
 	
 	def OnCustomCommandRequestHandler(self, sock, json_data):
-		print ("OnCustomCommandRequestHandler")
-		command = json_data['command']
-		if command in self.CustomRequestHandlers:
-			self.CustomRequestHandlers[command](sock, json_data)
+		LOG.debug("OnCustomCommandRequestHandler %s", json_data['command'])
+		self.Commands.Dispatch(sock, json_data)
 
 	def OnCustomCommandResponseHandler(self, sock, json_data):
 		print ("OnCustomCommandResponseHandler")
@@ -196,23 +171,24 @@ class Context():
 
 	def WorkingHandler(self):
 		if time.time() - self.CurrentTimestamp > self.Interval:
-			print ("WorkingHandler")
+			LOG.debug("WorkingHandler")
 
 			self.CheckingForUpdate = True
 			self.CurrentTimestamp = time.time()
 
 			for idx, item in enumerate(THIS.Node.LocalServiceNode.GetConnections()):
-				print ("  ", str(idx), item.LocalType, item.UUID, item.IP, item.Port, item.Type)
+				LOG.debug("  %s %s %s %s %s %s", idx, item.LocalType, item.UUID, item.IP, item.Port, item.Type)
 
 Service = MkSSlaveNode.SlaveNode()
 Node 	= MkSNode.Node("IP Scanner Service", Service)
 THIS 	= Context(Node)
 
 def signal_handler(signal, frame):
-	THIS.ThreadWorking = False
+	THIS.Presence.Stop()
 	THIS.Node.Stop()
 
 def main():
+	MkSLogger.Setup("presence")
 	signal.signal(signal.SIGINT, signal_handler)
 	THIS.Node.SetLocalServerStatus(True)
 	
@@ -237,7 +213,8 @@ def main():
 	THIS.Node.LocalServiceNode.OnCustomCommandResponseCallback		= THIS.OnCustomCommandResponseHandler
 	
 	THIS.Node.Run(THIS.WorkingHandler)
-	THIS.ThreadWorking = False
+	THIS.Presence.Stop()
+	MkSLogger.Flush()
 	print ("Exit Node ...")
 
 if __name__ == "__main__":
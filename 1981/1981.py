@@ -14,6 +14,8 @@ from mksdk import MkSLocalHWConnector
 from mksdk import MkSUSBAdaptor
 from mksdk import MkSProtocol
 
+from mkscommon import MkSNodeCommands
+
 from flask import Response, request
 
 import ConnectorArduino
@@ -33,6 +35,20 @@ class Context():
 		self.Handlers					= {
 			'undefined':			self.UndefindHandler
 		}
+		self.CustomRequestHandlers		= {
+		}
+		# Measured handlers, get_node_metrics and the dispatcher pool for slow handlers
+		self.Commands 					= MkSNodeCommands.NodeCommands(self.Node, self.Handlers, self.CustomRequestHandlers)
+		# Switch and timer requests come over REST, see OnLocalServerListenerStartedHandler
+		self.RestHandlers 				= {
+			'get_node_info':			self.GetNodeInfoHandler,
+			'set_node_info':			self.SetNodeInfoHandler,
+			'get_node_sensors':			self.GetSensorsInfoHandler,
+			'set_node_sensor_value':	self.SetSensorInfoHandler,
+			'set_node_timer_item':		self.SetTimerHandler,
+			'get_node_timer_items':		self.GetTimerHandlers
+		}
+		self.Commands.Metrics.Instrument(self.RestHandlers)
 		# Local network
 		self.LocalNetworkSocketList		= []
 		# Sensors
@@ -90,6 +106,10 @@ class Context():
 	def OnTerminateConnectionHandler(self, sock):
 		self.LocalNetworkSocketList.remove(sock)
 
+	def OnCustomCommandRequestHandler(self, sock, json_data):
+		print "OnCustomCommandRequestHandler", json_data['command']
+		self.Commands.Dispatch(sock, json_data)
+
 	def OnLocalServerStartedHandler(self):
 		pass
 
@@ -262,12 +282,12 @@ class Context():
 		return resp
 
 	def OnLocalServerListenerStartedHandler(self, sock, ip, port):
-		THIS.Node.LocalServiceNode.AppendFaceRestTable(endpoint="/get/node_info/<key>", 						endpoint_name="get_node_info", 			handler=THIS.GetNodeInfoHandler)
-		THIS.Node.LocalServiceNode.AppendFaceRestTable(endpoint="/set/node_info/<key>/<id>", 					endpoint_name="set_node_info", 			handler=THIS.SetNodeInfoHandler, 	method=['POST'])
-		THIS.Node.LocalServiceNode.AppendFaceRestTable(endpoint="/get/node_sensors_info/<key>", 				endpoint_name="get_node_sensors", 		handler=THIS.GetSensorsInfoHandler)
-		THIS.Node.LocalServiceNode.AppendFaceRestTable(endpoint="/set/node_sensor_info/<key>/<id>/<value>", 	endpoint_name="set_node_sensor_value", 	handler=THIS.SetSensorInfoHandler)
-		THIS.Node.LocalServiceNode.AppendFaceRestTable(endpoint="/set/node_timer_item/<key>/<id>", 				endpoint_name="set_node_timer_item", 	handler=THIS.SetTimerHandler, 		method=['POST'])
-		THIS.Node.LocalServiceNode.AppendFaceRestTable(endpoint="/get/node_timer_items/<key>/<id>", 			endpoint_name="get_node_timer_items", 	handler=THIS.GetTimerHandlers)
+		THIS.Node.LocalServiceNode.AppendFaceRestTable(endpoint="/get/node_info/<key>", 						endpoint_name="get_node_info", 			handler=THIS.RestHandlers["get_node_info"])
+		THIS.Node.LocalServiceNode.AppendFaceRestTable(endpoint="/set/node_info/<key>/<id>", 					endpoint_name="set_node_info", 			handler=THIS.RestHandlers["set_node_info"], 	method=['POST'])
+		THIS.Node.LocalServiceNode.AppendFaceRestTable(endpoint="/get/node_sensors_info/<key>", 				endpoint_name="get_node_sensors", 		handler=THIS.RestHandlers["get_node_sensors"])
+		THIS.Node.LocalServiceNode.AppendFaceRestTable(endpoint="/set/node_sensor_info/<key>/<id>/<value>", 	endpoint_name="set_node_sensor_value", 	handler=THIS.RestHandlers["set_node_sensor_value"])
+		THIS.Node.LocalServiceNode.AppendFaceRestTable(endpoint="/set/node_timer_item/<key>/<id>", 				endpoint_name="set_node_timer_item", 	handler=THIS.RestHandlers["set_node_timer_item"], 	method=['POST'])
+		THIS.Node.LocalServiceNode.AppendFaceRestTable(endpoint="/get/node_timer_items/<key>/<id>", 			endpoint_name="get_node_timer_items", 	handler=THIS.RestHandlers["get_node_timer_items"])
 
 	def WorkingHandler(self):
 		if time.time() - self.CurrentTimestamp > self.Interval:
@@ -326,6 +346,7 @@ def main():
 	# Communication events
 	THIS.Node.LocalServiceNode.OnGetSensorInfoRequestCallback 		= THIS.OnGetSensorInfoRequestHandler
 	THIS.Node.LocalServiceNode.OnSetSensorInfoRequestCallback 		= THIS.OnSetSensorInfoRequestHandler
+	THIS.Node.LocalServiceNode.OnCustomCommandRequestCallback		= THIS.OnCustomCommandRequestHandler
 	
 	THIS.Node.Run(THIS.WorkingHandler)
 	
@@ -6,10 +6,12 @@ import json
 import time
 import thread
 import threading
-import calendar
-from datetime import datetime
+import heapq
+from datetime import datetime, timedelta
 
-from mksdk import MkSFile
+from mkscommon import MkSWakeEvent
+
+import MkSTimerStore
 
 class TimerAction:
 	def __init__(self, clockId, timerId):
@@ -17,6 +19,12 @@ class TimerAction:
 		self.TimerId  	= timerId
 		self.Activated 	= False
 		self.TimeStamp  = None
+		# Parsed once, see MkSTimer.Schedule
+		self.Hour 		= 0
+		self.Minute 	= 0
+		self.Days 		= set()
+		self.NextFire 	= None
+		self.Cancelled 	= False
 
 class MkSTimer():
 	def __init__(self):
@@ -24,12 +32,13 @@ class MkSTimer():
 		self.IsThreadRunning  		= False
 		# Objects
 		self.CurrentTimestamp 		= time.time()
-		self.File 					= MkSFile.File()
+		self.Store 					= MkSTimerStore.TimerStore()
 		# Events
 		self.OnClockTickEvent 		= None
 		self.OnTimerTriggerEvent 	= None
 		self.Clocks 				= {}
 		self.Actions				= {}
+		# Events found late by more than this (seconds, e.g. after a suspend) are skipped
 		self.IntervalForAction 		= 10
 		self.ConvertionTable		= {	6: 'SUN', 
 										0: 'MON', 
@@ -38,6 +47,13 @@ class MkSTimer():
 										3: 'THU',  
 										4: 'FRI', 
 										5: 'SAT' }
+		self.WeekdayTable 			= dict((name, day) for day, name in self.ConvertionTable.items())
+		# Heap of (next fire timestamp, sequence, action), removed actions are skipped when popped
+		self.Queue 					= []
+		self.Sequence 				= 0
+		self.Lock 					= threading.Lock()
+		# Worker sleeps on this until the earliest event, Schedule and Stop wake it
+		self.WakeEvent 				= MkSWakeEvent.WakeEvent()
 
 	def Run(self):
 		self.IsThreadRunning = True
@@ -45,75 +61,130 @@ class MkSTimer():
 
 	def Stop(self):
 		self.IsThreadRunning = False
+		self.WakeEvent.set()
+		self.Store.Close()
+
+	# Local time of the first start at or after the given timestamp on one of the timer days.
+	def GetNextFire(self, action, after):
+		start = datetime.fromtimestamp(after).replace(hour=action.Hour, minute=action.Minute, second=0, microsecond=0)
+		for days in range(8):
+			candidate = start + timedelta(days=days)
+			if candidate.weekday() in action.Days:
+				timestamp = time.mktime(candidate.timetuple())
+				if timestamp >= after:
+					return timestamp
+		return None
+
+	# Called with the lock held.
+	def Push(self, action, after):
+		action.NextFire = self.GetNextFire(action, after)
+		if action.NextFire is None:
+			return
+		self.Sequence += 1
+		heapq.heappush(self.Queue, (action.NextFire, self.Sequence, action))
+
+	def Schedule(self, uuid, timer):
+		action 			= TimerAction(uuid, timer["id"])
+		hour, minute 	= timer["start"].split(":")
+		action.Hour 	= int(hour)
+		action.Minute 	= int(minute)
+		action.Days 	= set(self.WeekdayTable[day] for day in timer["days"] if day in self.WeekdayTable)
+
+		self.Lock.acquire()
+		previous = self.Actions.get((uuid, timer["id"]))
+		if previous is not None:
+			previous.Cancelled = True
+		self.Actions[(uuid, timer["id"])] = action
+		self.Push(action, time.time())
+		self.Lock.release()
+		# Wake the worker, the new timer may be the earliest one
+		self.WakeEvent.set()
+
+	def Unschedule(self, uuid, timerId):
+		self.Lock.acquire()
+		action = self.Actions.pop((uuid, timerId), None)
+		if action is not None:
+			action.Cancelled = True
+		self.Lock.release()
 
 	def WorkerThread(self):
 		print "[DEBUG::Timer] Start"
-		# TODO - Find next closest timestamp
+		nextTick = (int(time.time()) // 60 + 1) * 60
 		while self.IsThreadRunning:
-			Now 	= datetime.now()
-			Date 	= str(Now.day) + "-" + str(Now.month) + "-" + str(Now.year)
-
-			dtCurrent = Date + " " + str(Now.hour) + ":" + str(Now.minute)
-			currentStamp = datetime.strptime(dtCurrent, "%d-%m-%Y %H:%M")
-
-
-			self.CurrentTimestamp = calendar.timegm(currentStamp.utctimetuple())
-			for uuid, clock in self.Clocks.iteritems():
-				timers = clock["timers"]
-				for timer in timers:
-					DateTime 		= Date + " " + timer["start"]
-					CurrentDateTime = datetime.strptime(DateTime, "%d-%m-%Y %H:%M")
-					Timestamp 		= calendar.timegm(CurrentDateTime.utctimetuple())
-
-					objAction = self.Actions[(uuid, timer["id"])]
-					if self.ConvertionTable[datetime.today().weekday()] in timer["days"]:
-						if Timestamp <= self.CurrentTimestamp and (self.CurrentTimestamp - Timestamp) < self.IntervalForAction:
-							if objAction.Activated == False:
-								if self.OnTimerTriggerEvent is not None:
-									self.OnTimerTriggerEvent(uuid, timer["action"])
-									objAction.Activated = True
-									objAction.TimeStamp = self.CurrentTimestamp
-						else:
-							objAction.Activated = False
-
-			# Sleep till next minute
-			tillNextMinute = time.time() % 60
-			time.sleep(60 - int(tillNextMinute))
-
-			if self.OnClockTickEvent is not None:
+			self.Lock.acquire()
+			# Drop removed timers from the top
+			while len(self.Queue) > 0 and self.Queue[0][2].Cancelled is True:
+				heapq.heappop(self.Queue)
+
+			now = time.time()
+			wakeAt = nextTick
+			if len(self.Queue) > 0:
+				wakeAt = min(wakeAt, self.Queue[0][0])
+			if wakeAt > now:
+				self.Lock.release()
+				# A timer scheduled after wakeAt was taken is seen, the event stays set
+				self.WakeEvent.wait(wakeAt - now)
+				self.WakeEvent.clear()
+				continue
+
+			self.CurrentTimestamp = now
+			fired = []
+			while len(self.Queue) > 0 and self.Queue[0][0] <= now:
+				fireAt, sequence, action = heapq.heappop(self.Queue)
+				if action.Cancelled is True:
+					continue
+				if now - fireAt <= self.IntervalForAction:
+					action.Activated = True
+					action.TimeStamp = fireAt
+					fired.append(action)
+				self.Push(action, fireAt + 1)
+
+			tick = (now >= nextTick)
+			if tick is True:
+				nextTick = (int(now) // 60 + 1) * 60
+
+			# Callbacks run without the lock so they can add or remove timers
+			self.Lock.release()
+			for action in fired:
+				timer = self.FindTimer(action.ClockId, action.TimerId)
+				if timer is not None and self.OnTimerTriggerEvent is not None:
+					self.OnTimerTriggerEvent(action.ClockId, timer["action"])
+			if tick is True and self.OnClockTickEvent is not None:
 				self.OnClockTickEvent()
 		print "[DEBUG::Timer] Exit"
 
+	def FindTimer(self, uuid, timerId):
+		clock = self.Clocks.get(uuid)
+		if clock is None:
+			return None
+		for timer in clock["timers"]:
+			if timer["id"] == timerId:
+				return timer
+		return None
+
+	# Edits append one journal entry, see MkSTimerStore
 	def AddTimer(self, uuid, timer):
-		clock = self.Clocks[uuid]
-		clock["timers"].append(timer)
-		self.Clocks[uuid] = clock
-		self.SaveClock("timer/db_" + uuid + ".json", clock)
-		self.Actions[(uuid, timer["id"])] = TimerAction(uuid, timer["id"])
+		if uuid not in self.Clocks:
+			return
+		self.Store.AddTimer(uuid, timer)
+		self.Schedule(uuid, timer)
 
 	def RemoveTimer(self, uuid, timerId):
-		clock = self.Clocks[uuid]
-
-		for item in clock["timers"]:
+		if uuid not in self.Clocks:
+			return
+		for item in self.Clocks[uuid]["timers"]:
 			if str(item["id"]) == str(timerId):
-				clock["timers"].remove(item)
-				del self.Actions[(uuid, int(timerId))]
-
-		self.Clocks[uuid] = clock
-		self.SaveClock("timer/db_" + uuid + ".json", clock)
+				self.Unschedule(uuid, item["id"])
+		self.Store.RemoveTimer(uuid, timerId)
 
 	def GetTimers(self, uuid):
 		# TODO - Main process does not exit with this (BUG)
 		# return json.dumps(self.Timers.get(uuid))
 		return json.dumps(self.Clocks.get(uuid))
 
-	def SaveClock(self, file, clock):
-		self.File.SaveStateToFile(file, json.dumps(clock))
-
 	def LoadClocks(self, idList):
+		# One snapshot read and journal replay for all clocks
+		self.Clocks = self.Store.Load(idList)
 		for uuid in idList:
-			RawClocks = self.File.LoadStateFromFile("timer/db_" + uuid + ".json")
-			self.Clocks[uuid] = json.loads(RawClocks)
-			timers = self.Clocks[uuid]["timers"]
-			for timer in timers:
-				self.Actions[(uuid, timer["id"])] = TimerAction(uuid, timer["id"])
\ No newline at end of file
+			for timer in self.Clocks[uuid]["timers"]:
+				self.Schedule(uuid, timer)
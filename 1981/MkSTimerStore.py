@@ -0,0 +1,127 @@
+#!/usr/bin/python
+import os
+import json
+import threading
+
+# All clocks in one snapshot file (timers.json) plus an append only journal
+# (timers.journal) of timer additions and removals. An edit appends one line,
+# the snapshot is rewritten (temporary file and rename) only when the journal
+# grows past CompactAfter entries. Loading reads the snapshot and replays the
+# journal. Journal entries are numbered and the snapshot keeps the number of
+# the last entry it includes, so entries of a journal that was not truncated
+# yet (crash right after the rename) are skipped instead of applied twice.
+class TimerStore():
+	def __init__(self, path="timer", compact_after=200):
+		self.ObjName 		= "TimerStore"
+		self.Path 			= path
+		self.SnapshotPath 	= os.path.join(path, "timers.json")
+		self.JournalPath 	= os.path.join(path, "timers.journal")
+		self.CompactAfter 	= compact_after
+		self.Entries 		= 0
+		self.Sequence 		= 0
+		self.Clocks 		= {}
+		self.Journal 		= None
+		self.Lock 			= threading.Lock()
+
+	def Apply(self, entry):
+		clock = self.Clocks.get(entry["clock"])
+		if clock is None:
+			return
+		if "add" == entry["op"]:
+			clock["timers"].append(entry["timer"])
+		elif "remove" == entry["op"]:
+			clock["timers"] = [timer for timer in clock["timers"] if str(timer["id"]) != str(entry["id"])]
+
+	# Per sensor files of older versions (timer/db_<uuid>.json), read once on migration.
+	def LoadLegacy(self, uuid):
+		try:
+			with open(os.path.join(self.Path, "db_" + uuid + ".json"), "r") as clockFile:
+				return json.loads(clockFile.read())
+		except (IOError, ValueError):
+			return None
+
+	# Returns { uuid: clock } with a clock for every given id.
+	def Load(self, idList):
+		self.Lock.acquire()
+		try:
+			migrate = (os.path.exists(self.SnapshotPath) is False)
+			self.Sequence = 0
+			if migrate is False:
+				with open(self.SnapshotPath, "r") as snapshotFile:
+					snapshot = json.loads(snapshotFile.read())
+				self.Clocks 	= snapshot["clocks"]
+				self.Sequence 	= snapshot["sequence"]
+
+			for uuid in idList:
+				if uuid not in self.Clocks:
+					clock = self.LoadLegacy(uuid) if migrate is True else None
+					if clock is None:
+						clock = { 'timers': [], 'actions': ['On', 'Off'] }
+					self.Clocks[uuid] = clock
+
+			self.Entries = 0
+			if os.path.exists(self.JournalPath):
+				with open(self.JournalPath, "r") as journalFile:
+					for line in journalFile:
+						try:
+							entry = json.loads(line)
+						except ValueError:
+							# Torn last line of an interrupted append
+							continue
+						if entry["seq"] <= self.Sequence:
+							# Already in the snapshot
+							continue
+						self.Sequence = entry["seq"]
+						self.Apply(entry)
+						self.Entries += 1
+
+			self.Compact()
+			return self.Clocks
+		finally:
+			self.Lock.release()
+
+	# Called with the lock held.
+	def Compact(self):
+		if self.Journal is not None:
+			self.Journal.close()
+			self.Journal = None
+
+		if os.path.exists(self.Path) is False:
+			os.makedirs(self.Path)
+		tmpPath = self.SnapshotPath + ".tmp"
+		with open(tmpPath, "w") as snapshotFile:
+			snapshotFile.write(json.dumps({ 'sequence': self.Sequence, 'clocks': self.Clocks }))
+			snapshotFile.flush()
+			os.fsync(snapshotFile.fileno())
+		os.rename(tmpPath, self.SnapshotPath)
+
+		self.Journal = open(self.JournalPath, "w")
+		self.Entries = 0
+
+	def Append(self, entry):
+		self.Lock.acquire()
+		try:
+			self.Sequence += 1
+			entry["seq"] = self.Sequence
+			self.Apply(entry)
+			self.Journal.write(json.dumps(entry) + "\n")
+			self.Journal.flush()
+			os.fsync(self.Journal.fileno())
+			self.Entries += 1
+			if self.Entries >= self.CompactAfter:
+				self.Compact()
+		finally:
+			self.Lock.release()
+
+	def AddTimer(self, uuid, timer):
+		self.Append({ 'op': 'add', 'clock': uuid, 'timer': timer })
+
+	def RemoveTimer(self, uuid, timerId):
+		self.Append({ 'op': 'remove', 'clock': uuid, 'id': timerId })
+
+	def Close(self):
+		self.Lock.acquire()
+		if self.Journal is not None:
+			self.Journal.close()
+			self.Journal = None
+		self.Lock.release()
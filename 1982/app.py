@@ -6,6 +6,7 @@ import json
 import time
 import thread
 import threading
+import logging
 
 # Please remeber to install youtube-dl and python-vlc
 # C:/Python27/python.exe -m pip install -U <package>
@@ -19,8 +20,13 @@ from mksdk import MkSLocalHWConnector
 from mksdk import MkSUSBAdaptor
 from mksdk import MkSProtocol
 
+from mkscommon import MkSNodeCommands
+from mkscommon import MkSLogger
+
 from flask import Response, request
 
+LOG = logging.getLogger("player")
+
 class Context():
 	def __init__(self, node):
 		self.Interval					= 10
@@ -40,6 +46,8 @@ class Context():
             'vol_up':                   self.VolumeUpHandler,
             'vol_down':                 self.VolumeDownHandler,
 		}
+		# Measured handlers, get_node_metrics and the dispatcher pool for slow handlers
+		self.Commands 							= MkSNodeCommands.NodeCommands(self.Node, self.Handlers, self.CustomRequestHandlers)
 		self.CustomResponseHandlers				= {
 		}
         # Player
@@ -135,10 +143,8 @@ class Context():
 		print "OnSetSensorInfoRequestHandler"
 	
 	def OnCustomCommandRequestHandler(self, sock, json_data):
-		print ("OnCustomCommandRequestHandler")
-		command = json_data['command']
-		if command in self.CustomRequestHandlers:
-			self.CustomRequestHandlers[command](sock, json_data)
+		LOG.debug("OnCustomCommandRequestHandler %s", json_data['command'])
+		self.Commands.Dispatch(sock, json_data)
 
 	def OnCustomCommandResponseHandler(self, sock, json_data):
 		print ("OnCustomCommandResponseHandler")
@@ -190,6 +196,7 @@ def signal_handler(signal, frame):
 	THIS.Node.Stop()
 
 def main():
+	MkSLogger.Setup("player")
 	signal.signal(signal.SIGINT, signal_handler)
 	THIS.Node.SetLocalServerStatus(True)
 	
@@ -214,6 +221,7 @@ def main():
 	THIS.Node.LocalServiceNode.OnCustomCommandResponseCallback		= THIS.OnCustomCommandResponseHandler
 	
 	THIS.Node.Run(THIS.WorkingHandler)
+	MkSLogger.Flush()
 	print "Exit Node ..."
 
 if __name__ == "__main__":
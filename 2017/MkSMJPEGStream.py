@@ -0,0 +1,100 @@
+#!/usr/bin/python
+import socket
+import httplib
+import logging
+
+from mkscommon import MkSLogger
+
+LOG 	= logging.getLogger("camera.stream")
+# Dropped streams are reopened right away, one line per camera and interval
+SAMPLED = MkSLogger.Sampled(LOG, 30)
+
+# Splits concatenated JPEG data (an MJPEG stream or a recorded segment) into frames.
+# Frames are cut on the JPEG SOI/EOI markers, so multipart headers and
+# boundaries are skipped without parsing them.
+class JPEGSplitter():
+	def __init__(self):
+		# Reused between frames, consumed bytes are cut from the front
+		self.Buffer 		= bytearray()
+
+	def Reset(self):
+		del self.Buffer[:]
+
+	# Yields frames until read returns no more data.
+	def Frames(self, read, chunk_size):
+		start 	= -1
+		offset 	= 0
+		while True:
+			chunk = read(chunk_size)
+			if not chunk:
+				break
+			self.Buffer.extend(chunk)
+
+			while True:
+				if start < 0:
+					start = self.Buffer.find(b"\xff\xd8", offset)
+					if start < 0:
+						# Drop part headers, keep a trailing 0xff as it may be half a marker
+						del self.Buffer[:max(len(self.Buffer) - 1, 0)]
+						offset = 0
+						break
+					offset = start + 2
+				end = self.Buffer.find(b"\xff\xd9", offset)
+				if end < 0:
+					offset = max(len(self.Buffer) - 1, start + 2)
+					break
+				frame = bytes(self.Buffer[start:end + 2])
+				del self.Buffer[:end + 2]
+				start 	= -1
+				offset 	= 0
+				yield frame
+		self.Reset()
+
+# Reads a multipart/x-mixed-replace MJPEG stream and splits it into JPEG frames.
+class MJPEGStream():
+	def __init__(self, client, path, chunk_size=4096):
+		self.ObjName 		= "MJPEGStream"
+		self.Client 		= client
+		self.Path 			= path
+		self.ChunkSize 		= chunk_size
+		self.Connection 	= None
+		self.Response 		= None
+		self.Splitter 		= JPEGSplitter()
+		self.IsSupported 	= True
+
+	# Returns False when the camera could not be reached or does not stream.
+	def Open(self):
+		self.Close()
+		self.Connection, self.Response = self.Client.Open(self.Path)
+		if self.Response is None:
+			return False
+
+		contentType = self.Response.getheader("content-type", "")
+		if self.Response.status != 200 or "multipart" not in contentType:
+			LOG.warning("[%s] Stream not supported %s %s %s", self.ObjName, self.Client.Host, self.Response.status, contentType)
+			self.IsSupported = False
+			self.Close()
+			return False
+		return True
+
+	def Close(self):
+		if self.Connection is not None:
+			self.Connection.close()
+		self.Connection = None
+		self.Response 	= None
+		self.Splitter.Reset()
+
+	def Read(self, size):
+		if self.Response is None:
+			return ""
+		try:
+			return self.Response.read(size)
+		except (httplib.HTTPException, socket.error) as e:
+			SAMPLED.warning(self.Client.Host, "[%s] Exception %s %s", self.ObjName, self.Client.Host, e)
+			return ""
+
+	# Yields frames until the stream ends or the connection drops.
+	def Frames(self):
+		for frame in self.Splitter.Frames(self.Read, self.ChunkSize):
+			yield frame
+		self.Close()
@@ -0,0 +1,71 @@
+#!/usr/bin/python
+import os
+import time
+
+# Spools recorded JPEG frames into a segment file on disk, so a camera only
+# holds the frame being written. Segments are rotated by frame count or by
+# wall-clock duration and handed over to OnSegmentReady({'segment': path, 'frames': count}).
+class SegmentRecorder():
+	def __init__(self, folder):
+		self.ObjName 			= "SegmentRecorder"
+		self.Folder 			= folder
+		self.FramesPerSegment 	= 2000
+		self.SecondsPerSegment 	= 0 # 0 - rotate by frame count only
+		self.OnSegmentReady 	= None
+		self.File 				= None
+		self.Path 				= None
+		self.Frames 			= 0
+		self.StartTimestamp 	= 0
+
+		if not os.path.exists(self.Folder):
+			os.makedirs(self.Folder)
+
+	def SetFramesPerSegment(self, value):
+		self.FramesPerSegment = value
+
+	def SetSecondsPerSegment(self, value):
+		self.SecondsPerSegment = value
+
+	def GetFrameCount(self):
+		return self.Frames
+
+	def Append(self, frame):
+		if self.File is None:
+			self.StartTimestamp = time.time()
+			self.Path 			= os.path.join(self.Folder, "segment" + str(self.StartTimestamp) + ".mjpeg")
+			self.File 			= open(self.Path, "wb")
+			self.Frames 		= 0
+
+		self.File.write(frame)
+		self.Frames += 1
+
+		if self.FramesPerSegment <= self.Frames:
+			self.Rotate()
+		else:
+			self.CheckDuration()
+
+	# Motion triggered recording may not append for a long time, call this on every frame.
+	def CheckDuration(self):
+		if self.File is None or self.SecondsPerSegment <= 0:
+			return
+		if time.time() - self.StartTimestamp >= self.SecondsPerSegment:
+			self.Rotate()
+
+	# Close the current segment and hand it over, if it has any frames.
+	def Rotate(self):
+		if self.File is None:
+			return
+
+		self.File.close()
+		segment = {
+			'segment': 	self.Path,
+			'frames': 	self.Frames
+		}
+		self.File 	= None
+		self.Path 	= None
+		self.Frames = 0
+
+		if self.OnSegmentReady is not None:
+			self.OnSegmentReady(segment)
+		else:
+			os.remove(segment['segment'])
@@ -8,20 +8,17 @@ import time
 import thread
 import threading
 import logging
-logging.basicConfig(
-	filename='app.log',
-	level=logging.DEBUG,
-    format='%(asctime)s.%(msecs)03d %(levelname)s %(module)s - %(funcName)s: %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S',
-)
 
 import subprocess
+import shutil
 import urllib2
 import urllib
 import re
 from subprocess import call
 from subprocess import Popen, PIPE
 import Queue
+import collections
+import multiprocessing
 
 import numpy as np
 from PIL import Image
@@ -37,58 +34,27 @@ from mksdk import MkSLocalHWConnector
 from mksdk import MkSUSBAdaptor
 from mksdk import MkSProtocol
 
+from mkscommon import MkSDeviceScanner
+from mkscommon import MkSJSONStore
+from mkscommon import MkSDeviceRegistry
+from mkscommon import MkSDeviceReconciler
+from mkscommon import MkSDiscoveryScheduler
+from mkscommon import MkSHTTPClient
+from mkscommon import MkSNodeCommands
+from mkscommon import MkSLogger
+
 from flask import Response, request
 from flask import send_file
 
-class EthernetDeviceScanner():
-	def __init__(self):
-		self.ObjName 			= "EthernetDeviceScanner"
-		self.IPList				= []
-		self.ThreadCounter 		= 0
-		self.ThreadCounterLock	= threading.Lock()
-
-	def Ping(self, address):
-		response = subprocess.call("ping -c 1 %s" % address,
-				shell=True,
-				stdout=open('/dev/null', 'w'),
-				stderr=subprocess.STDOUT)
-		# Check response
-		if response == 0:
-			return True
-		else:
-			return False
-	
-	def PingThread(self, address):
-		res = self.Ping(address)
-		self.ThreadCounterLock.acquire()
-		if True == res:
-			self.IPList.append(address)
-		self.ThreadCounter += 1
-		self.ThreadCounterLock.release()
-
-	def Scan(self, network, index):
-		self.ThreadCounter 		= 0
-		self.Network		 	= network
-		self.IPCount 			= index[1] - index[0]
-
-		if (self.IPCount < 0):
-			return []
-		
-		for i in range(index[0], index[1]):
-			address = self.Network + str(i)
-			thread.start_new_thread(self.PingThread, (address,))
-		
-		while (self.ThreadCounter != self.IPCount):
-			pass
-		
-		return self.IPList
+import MkSMJPEGStream
+import MkSRecorder
+
+LOG = logging.getLogger("camera")
 
 class HJTCameraScanner():
-	def __init__(self):
+	def __init__(self, scanner):
 		self.ObjName 			= "HJTCameraScanner"
-		self.Cameras			= []
-		self.ThreadCounter 		= 0
-		self.ThreadCounterLock	= threading.Lock()
+		self.Scanner			= scanner
 
 	def SendRequest(self, url):
 		try:
@@ -101,90 +67,252 @@ class HJTCameraScanner():
 		
 		return False
 	
-	def RequestThread(self, address):
-		res = self.SendRequest(address)
-		self.ThreadCounterLock.acquire()
-		if True == res:
-			self.Cameras.append(address)
-		self.ThreadCounter += 1
-		self.ThreadCounterLock.release()
-
 	def Scan(self, addresses):
-		self.ThreadCounter 		= 0
-		self.CamerasCount 		= len(addresses)
-
-		if (self.CamerasCount < 0):
-			return []
-		
-		for ip in addresses:
-			thread.start_new_thread(self.RequestThread, (ip,))
-		
-		while (self.ThreadCounter != self.CamerasCount):
-			pass
-		
-		return self.Cameras
+		return self.Scanner.Probe(addresses, self.SendRequest)
 
 class VideoCreator():
-	def __init__(self):
-		self.ObjName 	= "VideoCreator"
-		self.Orders 	= Queue.Queue()
-		self.IsRunning	= True
-		self.FPS		= 8
-		thread.start_new_thread(self.OrdersManagerThread, ())
+	def __init__(self, workers=None, max_pending=8):
+		self.ObjName 		= "VideoCreator"
+		self.IsRunning		= True
+		self.FPS			= 8
+		self.Workers 		= workers or multiprocessing.cpu_count()
+		# Pending orders per camera, a camera is encoded by one worker at a time
+		# so its videos come out in recording order.
+		self.Orders 		= {}
+		self.Busy 			= set()
+		self.Pending 		= 0
+		self.MaxPending 	= max_pending
+		# Above this many pending orders new videos are muxed without transcoding
+		self.DegradePending = max_pending / 2
+		self.Condition 		= threading.Condition()
+		# Output codec arguments, 'copy' muxes the camera JPEGs into the AVI as they are
+		self.Codecs 		= {
+			'mpeg4': 	['-vcodec', 'mpeg4', '-qscale', '5'],
+			'copy': 	['-vcodec', 'copy']
+		}
+		# Metrics
+		self.Encoded 		= 0
+		self.EncodedFrames 	= 0
+		self.EncodingTime 	= 0.0
+		self.Dropped 		= 0
+		self.Degraded 		= 0
+		self.Failed 		= 0
+
+		for idx in range(self.Workers):
+			worker = threading.Thread(target=self.OrdersManagerThread, name=self.ObjName + "_" + str(idx))
+			worker.daemon = True
+			worker.start()
 	
 	def SetFPS(self, fps):
 		self.FPS = fps
 
+	# Order - {'camera', 'folder', 'segment', 'frames', 'codec'}
 	def AddOrder(self, order):
-		self.Orders.put(order)
-		self.IsRunning = True
+		self.Condition.acquire()
+		if self.Pending >= self.MaxPending:
+			self.DropOldest()
+		if self.Pending >= self.DegradePending and order.get("codec") != 'copy':
+			order["codec"] = 'copy'
+			self.Degraded += 1
+		self.Orders.setdefault(order["camera"], collections.deque()).append(order)
+		self.Pending += 1
+		self.Condition.notify()
+		self.Condition.release()
+
+	# Called with the condition held. Drops the oldest order of the camera with the longest backlog.
+	def DropOldest(self):
+		camera = max(self.Orders, key=lambda key: len(self.Orders[key]))
+		order = self.Orders[camera].popleft()
+		if 0 == len(self.Orders[camera]):
+			del self.Orders[camera]
+		self.Pending -= 1
+		self.Dropped += 1
+		LOG.warning("[VideoCreator] Queue full, dropping %s", order["segment"])
+		try:
+			os.remove(order["segment"])
+		except OSError:
+			pass
+
+	def GetStatistics(self):
+		self.Condition.acquire()
+		stats = {
+			'workers': 				self.Workers,
+			'pending': 				self.Pending,
+			'max_pending': 			self.MaxPending,
+			'encoding': 			len(self.Busy),
+			'pending_per_camera': 	dict((camera, len(orders)) for camera, orders in self.Orders.items()),
+			'encoded': 				self.Encoded,
+			'dropped': 				self.Dropped,
+			'degraded': 			self.Degraded,
+			'failed': 				self.Failed,
+			'frames_per_second': 	int(self.EncodedFrames / self.EncodingTime) if self.EncodingTime > 0 else 0
+		}
+		self.Condition.release()
+		return stats
+
+	def GetCodecArguments(self, codec):
+		if codec not in self.Codecs:
+			codec = 'mpeg4'
+		if 'copy' == codec:
+			# Stream copy keeps the input frame rate
+			return self.Codecs[codec]
+		return self.Codecs[codec] + ['-r', str(self.FPS)]
+
+	# Called with the condition held.
+	def GetNextOrder(self):
+		for camera in self.Orders:
+			if camera not in self.Busy:
+				order = self.Orders[camera].popleft()
+				if 0 == len(self.Orders[camera]):
+					del self.Orders[camera]
+				self.Pending -= 1
+				self.Busy.add(camera)
+				return order
+		return None
+
+	# A segment that could not be encoded is the only copy of the recording,
+	# it is kept next to the others as <segment>.failed.
+	def SetAside(self, segment):
+		try:
+			os.rename(segment, segment + ".failed")
+		except OSError as e:
+			LOG.error("[VideoCreator] Could not keep %s %s", segment, e)
+
+	# Returns True when the video was written and the segment removed.
+	def Encode(self, item):
+		LOG.debug("[VideoCreator] Start video encoding %s", item["segment"])
+		segment = item["segment"]
+		if not os.path.exists(item["folder"]):
+			os.makedirs(item["folder"])
+		video = os.path.join(item["folder"], 'video'+str(time.time())+'.avi')
+		# Segment is already a JPEG sequence, it goes to ffmpeg without decoding it here
+		recordingProcess = Popen(['ffmpeg', '-y', '-f', 'image2pipe', '-vcodec', 'mjpeg', '-r', str(self.FPS), '-i', '-'] +
+									self.GetCodecArguments(item.get("codec")) +
+									[video], stdin=PIPE)
+		with open(segment, "rb") as segmentFile:
+			shutil.copyfileobj(segmentFile, recordingProcess.stdin, 65536)
+		recordingProcess.stdin.close()
+		code = recordingProcess.wait()
+		if code != 0:
+			LOG.error("[VideoCreator] ffmpeg failed (%s) on %s %s", code, segment, item.get("codec"))
+			if os.path.exists(video):
+				os.remove(video)
+			self.SetAside(segment)
+			return False
+		os.remove(segment)
+		LOG.info("[VideoCreator] Encoded %s %s frames %s", segment, item["frames"], item.get("codec"))
+		return True
 
 	def OrdersManagerThread(self):
-		# TODO - Put in TRY CATCH
 		while (self.IsRunning is True):
-			item = self.Orders.get(block=True,timeout=None)
-			logging.info("[VideoCreator] Start video encoding...")
-			images = item["images"]
-			recordingProcess = Popen(['ffmpeg', '-y', '-f', 'image2pipe', '-vcodec', 'mjpeg', '-r', str(self.FPS), '-i', '-', '-vcodec', 'mpeg4', '-qscale', '5', '-r', str(self.FPS), './videos/video'+str(time.time())+'.avi'], stdin=PIPE)
-			for frame in images:
-				image = Image.open(BytesIO(frame))
-				image.save(recordingProcess.stdin, 'JPEG')
-			recordingProcess.stdin.close()
-			recordingProcess.wait()
-			logging.debug("[VideoCreator] {images} {item}".format(images = str(id(images)), item = str(id(item))))
-			images = []
-			item = None
-			logging.info("[VideoCreator] Start video encoding... DONE")
-			gc.collect()
+			self.Condition.acquire()
+			item = self.GetNextOrder()
+			while item is None:
+				self.Condition.wait()
+				item = self.GetNextOrder()
+			self.Condition.release()
+
+			start = time.time()
+			encoded = False
+			try:
+				encoded = self.Encode(item)
+			except Exception as e:
+				LOG.exception("[VideoCreator] Exception %s %s", item["segment"], e)
+				if os.path.exists(item["segment"]):
+					self.SetAside(item["segment"])
+
+			self.Condition.acquire()
+			self.Busy.discard(item["camera"])
+			if encoded is True:
+				self.Encoded 		+= 1
+				self.EncodedFrames 	+= item["frames"]
+				self.EncodingTime 	+= time.time() - start
+			else:
+				self.Failed 		+= 1
+			# This camera may have more orders waiting for a free worker
+			self.Condition.notify_all()
+			self.Condition.release()
 
 GEncoder = VideoCreator()
 
+# Region of interest is [left, top, right, bottom] fractions of the frame, None for the whole frame.
+def IsValidRegion(region):
+	if region is None:
+		return True
+	try:
+		left, top, right, bottom = [float(item) for item in region]
+	except (TypeError, ValueError):
+		return False
+	return 0 <= left < right <= 1 and 0 <= top < bottom <= 1
+
 class MkSImageProcessing():
 	def __init__(self):
-		self.ObjName 	= "ImageProcessing"
-		self.MAX_DIFF	= 5000 # MAX = 261120
-	
+		self.ObjName 		= "ImageProcessing"
+		self.MAX_DIFF		= 20000 # MAX = 261120, sensor noise stays above 98%
+		self.Size 			= (32, 32)
+		# JPEG decoder scales down by up to 1/8 while decoding, never below this size
+		self.DraftSize 		= (64, 64)
+		# Region of interest as fractions of the frame (left, top, right, bottom)
+		self.Region 		= None
+		# Reduced frames are kept so every frame is decoded only once
+		self.Current 		= np.zeros(self.Size, dtype=np.int32)
+		self.CurrentFrame 	= None
+		self.Reference 		= np.zeros(self.Size, dtype=np.int32)
+		self.ReferenceFrame = None
+		self.Diff 			= np.zeros(self.Size, dtype=np.int32)
+		self.Log 			= MkSLogger.Sampled(LOG, 30)
+
+	def SetRegion(self, region):
+		if region is None or IsValidRegion(region) is False:
+			self.Region = None
+		else:
+			self.Region = [float(item) for item in region]
+		# Cached frames were reduced with the old region
+		self.CurrentFrame 	= None
+		self.ReferenceFrame = None
+
+	def Reduce(self, frame, out):
+		image = Image.open(BytesIO(frame))
+		image.draft('L', self.DraftSize)
+		image = image.convert('L')
+		if self.Region is not None:
+			width, height = image.size
+			left 	= int(self.Region[0] * width)
+			top 	= int(self.Region[1] * height)
+			# Keep at least one pixel of a very thin region
+			image = image.crop((	left, top,
+									max(int(self.Region[2] * width), left + 1), max(int(self.Region[3] * height), top + 1)))
+		# Emboss after the resize, so the diff scale (MAX_DIFF) does not depend on
+		# the camera resolution or on how far the decoder could scale down
+		image = image.resize(self.Size, resample=Image.BICUBIC).filter(ImageFilter.EMBOSS)
+		np.copyto(out, np.asarray(image), casting='unsafe')
+
 	def CompareJpegImages(self, img_one, img_two):
 		if (img_one is None or img_two is None):
 			return 0
 		
 		try:
-			emboss_img_one = Image.open(BytesIO(img_one)).filter(ImageFilter.EMBOSS)
-			emboss_img_two = Image.open(BytesIO(img_two)).filter(ImageFilter.EMBOSS)
-
-			im = [None, None] 								# to hold two arrays
-			for i, f in enumerate([emboss_img_one, emboss_img_two]):
-				# .filter(ImageFilter.GaussianBlur(radius=2))) # blur using PIL
-				im[i] = (np.array(f
-				.convert('L')            					# convert to grayscale using PIL
-				.resize((32,32), resample=Image.BICUBIC)) 	# reduce size and smooth a bit using PIL
-				).astype(np.int)   							# convert from unsigned bytes to signed int using numpy
-			diff_precentage = (float(self.MAX_DIFF - (np.abs(im[0] - im[1]).sum())) / self.MAX_DIFF) * 100
+			if img_two is not self.ReferenceFrame:
+				if img_two is self.CurrentFrame:
+					# Previous frame became the reference, reuse its reduced array
+					self.Reference, self.Current = self.Current, self.Reference
+				else:
+					self.Reduce(img_two, self.Reference)
+				self.ReferenceFrame = img_two
+			self.CurrentFrame = None
+			self.Reduce(img_one, self.Current)
+			self.CurrentFrame = img_one
+
+			np.subtract(self.Current, self.Reference, out=self.Diff)
+			np.abs(self.Diff, out=self.Diff)
+			diff_precentage = (float(self.MAX_DIFF - self.Diff.sum()) / self.MAX_DIFF) * 100
 			if (diff_precentage < 0):
 				return 0
 			return diff_precentage
 		except Exception as e:
-			print ("[MkSImageProcessing] Exception", e)
+			self.Log.warning("compare", "[MkSImageProcessing] Exception %s", e)
+			self.CurrentFrame 	= None
+			self.ReferenceFrame = None
 			return 0
 
 class ICamera():
@@ -192,48 +320,57 @@ class ICamera():
 		self.ImP						= MkSImageProcessing()
 		self.IPAddress 					= ip
 		self.Address 					= "http://" + self.IPAddress + "/"
+		self.HTTP 						= MkSHTTPClient.HTTPClient(self.IPAddress, username='admin', password='admin', timeout=3)
 		self.IsGetFrame 				= False
 		self.IsRecoding 				= False
 		self.IsCameraWorking 			= False
 		self.IsSecurity					= False
 		self.FramesPerVideo 			= 2000
+		self.SecondsPerVideo 			= 0
 		self.RecordingSensetivity 		= 95
 		self.SecuritySensitivity 		= 92
-		self.CurrentImageIndex 			= 0
 		self.OnImageDifferentCallback	= None
 		self.State 						= 0
+		# MJPEG stream, None for cameras that only serve snapshots
+		self.Stream 					= None
+		self.FramePrev 					= None
+		self.Recorder 					= MkSRecorder.SegmentRecorder(os.path.join(".videos", self.IPAddress))
+		self.Recorder.OnSegmentReady 	= self.OnSegmentReady
+		self.VideoCodec 				= "mpeg4"
+		# Per frame traces, at most one per key every few seconds
+		self.FrameLog 					= MkSLogger.Sampled(LOG, 5)
 
 	def SetFramesPerVideo(self, value):
 		self.FramesPerVideo = value
+		self.Recorder.SetFramesPerSegment(value)
+
+	def SetSecondsPerVideo(self, value):
+		self.SecondsPerVideo = value
+		self.Recorder.SetSecondsPerSegment(value)
+
+	def SetVideoCodec(self, codec):
+		self.VideoCodec = codec
 
 	def SetRecordingSensetivity(self, value):
 		self.RecordingSensetivity = value
 
-	def GetRequest (self, url):
-		username = 'admin'
-		password = 'admin'
-		
-		try:
-			p = urllib2.HTTPPasswordMgrWithDefaultRealm()
-			p.add_password(None, url, username, password)
+	def SetMotionRegion(self, region):
+		self.ImP.SetRegion(region)
 
-			handler = urllib2.HTTPBasicAuthHandler(p)
-			opener = urllib2.build_opener(handler)
-			urllib2.install_opener(opener)
-			data = urllib2.urlopen(url).read()
-		except Exception as e:
-			# TODO - Exit node
-			print ("HTTPException", e)
-			return "", True
+	def GetRequest (self, command):
+		return self.HTTP.Get("/" + command)
 
-		return data, False
+	def GetStatistics(self):
+		return self.HTTP.GetStatistics()
 
 	def GetCapturingProcess(self):
-		return int((float(self.CurrentImageIndex) / float(self.FramesPerVideo)) * 100.0)
+		return int((float(self.Recorder.GetFrameCount()) / float(self.FramesPerVideo)) * 100.0)
 
 	def Frame(self):
 		command = self.GetFrame()
-		frame, error = self.GetRequest(self.Address + command)
+		frame, error = self.GetRequest(command)
+		if error is True:
+			return None
 		return frame
 	
 	def SetState(self, state):
@@ -275,67 +412,76 @@ class ICamera():
 		self.IsCameraWorking = False
 
 	def CameraThread(self):
-		global GEncoder
-		
-		frameCurr 		= None
-		framePrev 		= None
-		frameDifference = 0
-
-		# TODO - Create logging to file system.
-		# TODO - Create common print message format
-		# TODO - Each camera has its own folder
-		# TODO - Is video creation is on going?
-		# TODO - Each camera must have its own video folder.
-
-		recordingBuffers = [[],[]]
-		recordingBufferIndex = 0
 		self.IsCameraWorking = True
 		while self.IsCameraWorking is True:
-			if self.IsGetFrame is True:
-				frameCurr = self.Frame()
-				frameDifference = self.ImP.CompareJpegImages(frameCurr, framePrev)
+			if self.IsGetFrame is False:
+				time.sleep(0.5)
+			elif self.Stream is not None and self.Stream.IsSupported is True:
+				self.StreamFrames()
 			else:
+				frame = self.Frame()
+				if frame is None:
+					# Unreachable or backing off (HTTPClient.NextAttempt), do not spin
+					time.sleep(0.5)
+				self.OnFrame(frame)
+		# Hand over what was recorded so far
+		self.Recorder.Rotate()
+
+	# Connect once to the MJPEG endpoint and handle frames as they arrive.
+	# Returns on disconnect, the camera thread reconnects or falls back to polling.
+	def StreamFrames(self):
+		if self.Stream.Open() is False:
+			if self.Stream.IsSupported is True:
 				time.sleep(0.5)
-			
-			if self.IsSecurity is True:
-				if (frameDifference < self.SecuritySensitivity):
-					print("[Camera] Security {diff} {sensitivity}".format(diff = str(frameDifference), sensitivity = str(self.SecuritySensitivity)))
-					framePrev = frameCurr
-					if self.OnImageDifferentCallback is not None:
-						self.OnImageDifferentCallback(self.IPAddress, frameCurr)
-			
-			if self.IsRecoding is True:
-				if (frameDifference < self.RecordingSensetivity):
-					recordingBuffers[recordingBufferIndex].append(frameCurr)
-					print("[Camera] Recording {frames} {diff} {sensitivity}".format(frames = str(len(recordingBuffers[recordingBufferIndex])), diff = str(frameDifference), sensitivity = str(self.RecordingSensetivity)))
-					framePrev = frameCurr
-					self.CurrentImageIndex = len(recordingBuffers[recordingBufferIndex])
-				
-				if self.FramesPerVideo <= self.CurrentImageIndex:
-					GEncoder.AddOrder({
-						'images': recordingBuffers[recordingBufferIndex]
-					})
-					logging.debug("Sent recording order " + str(id(recordingBuffers[recordingBufferIndex])))
-
-					if 1 == recordingBufferIndex:
-						recordingBufferIndex = 0
-					else:
-						recordingBufferIndex = 1
-					
-					recordingBuffers[recordingBufferIndex] = []
-					self.CurrentImageIndex = len(recordingBuffers[recordingBufferIndex])
-					gc.collect()
+			return
+
+		for frame in self.Stream.Frames():
+			self.OnFrame(frame)
+			if self.IsCameraWorking is False or self.IsGetFrame is False:
+				break
+		self.Stream.Close()
+
+	def GetVideosFolder(self):
+		return os.path.join("videos", self.IPAddress)
+
+	def OnSegmentReady(self, segment):
+		segment['camera'] = self.IPAddress
+		segment['folder'] = self.GetVideosFolder()
+		segment['codec'] = self.VideoCodec
+		GEncoder.AddOrder(segment)
+
+	def OnFrame(self, frameCurr):
+		if frameCurr is None:
+			return
+
+		frameDifference = self.ImP.CompareJpegImages(frameCurr, self.FramePrev)
+		if self.IsSecurity is True:
+			if (frameDifference < self.SecuritySensitivity):
+				self.FrameLog.debug("security", "[Camera] Security %s %s %s", self.IPAddress, frameDifference, self.SecuritySensitivity)
+				self.FramePrev = frameCurr
+				if self.OnImageDifferentCallback is not None:
+					self.OnImageDifferentCallback(self.IPAddress, frameCurr)
+		
+		if self.IsRecoding is True:
+			if (frameDifference < self.RecordingSensetivity):
+				self.Recorder.Append(frameCurr)
+				self.FrameLog.debug("recording", "[Camera] Recording %s %s %s %s", self.IPAddress, self.Recorder.GetFrameCount(), frameDifference, self.RecordingSensetivity)
+				self.FramePrev = frameCurr
+			else:
+				self.Recorder.CheckDuration()
 
 class HJTCamera(ICamera):
 	def __init__(self, ip):
 		ICamera.__init__(self, ip)
 		self.Commands = {
 			'frame': 			"tmpfs/auto.jpg",
+			'stream': 			"mjpegstream.cgi?-chn=11",
 			'getnetattr': 		"web/cgi-bin/hi3510/param.cgi?cmd=getnetattr",
 			'getserverinfo': 	"web/cgi-bin/hi3510/param.cgi?cmd=getserverinfo",
 			'getxqp2pattr': 	"web/cgi-bin/hi3510/param.cgi?cmd=getxqp2pattr"
 		}
 		self.UserSensitiviy = 0
+		self.Stream = MkSMJPEGStream.MJPEGStream(self.HTTP, "/" + self.Commands['stream'])
 
 	def GetIp(self):
 		return self.IPAddress
@@ -347,7 +493,7 @@ class HJTCamera(ICamera):
 		return self.Commands['frame']
 
 	def GetUID(self):
-		data, error = self.GetRequest(self.Address + self.Commands['getxqp2pattr'])
+		data, error = self.GetRequest(self.Commands['getxqp2pattr'])
 		items = data.split("\r\n")
 		for item in items:
 			if "xqp2p_uid" in item:
@@ -356,7 +502,7 @@ class HJTCamera(ICamera):
 		return 0
 
 	def GetMACAddress(self):
-		data, error = self.GetRequest(self.Address + self.Commands['getnetattr'])
+		data, error = self.GetRequest(self.Commands['getnetattr'])
 		if error is True:
 			return ""
 
@@ -391,37 +537,46 @@ class Context():
 			'get_videos_list':							self.GetVideosListHandler,
 			'get_misc_information':						self.GetMiscInformationHandler,
 			'set_misc_information':						self.SetMiscInformationHandler,
+			'get_camera_statistics':					self.GetCameraStatisticsHandler,
+			'get_encoder_statistics':					self.GetEncoderStatisticsHandler,
 		}
+		# Measured handlers, get_node_metrics and the dispatcher pool for slow handlers
+		self.Commands 							= MkSNodeCommands.NodeCommands(self.Node, self.Handlers, self.CustomRequestHandlers)
+		self.Commands.Offload('get_misc_information')
+		self.Commands.Offload('get_videos_list')
 		self.CustomResponseHandlers				= {
 		}
 
 		self.DB							= None
-		self.Cameras 					= []
-		self.ObjCameras					= []
-		self.DeviceScanner 				= EthernetDeviceScanner()
+		self.Store 						= MkSJSONStore.JSONStore("db.json")
+		self.Registry 					= MkSDeviceRegistry.DeviceRegistry(["ip", "mac", "uid"])
+		self.DeviceScanner 				= MkSDeviceScanner.DeviceScanner()
+		self.HJTScanner 				= HJTCameraScanner(self.DeviceScanner)
+		self.Reconciler 				= MkSDeviceReconciler.DeviceReconciler(self.Registry, self.DeviceScanner, self.FingerprintCamera)
+		self.Reconciler.OnDeviceAppend 	= self.AppendCamera
+		self.Reconciler.OnDeviceRemove 	= self.RemoveCamera
 		self.SecurityEnabled 			= False
 		self.SMSService					= ""
 		self.EmailService				= ""
 
 		self.LastTSEmailSent			= 0
-		self.HJTDetectorTimestamp 		= time.time()
+		self.Discovery 					= MkSDiscoveryScheduler.DiscoveryScheduler(self.DiscoverCameras, 60)
 
 	def UndefindHandler(self, message_type, source, data):
 		print ("UndefindHandler")
 
+	def FindCamera(self, packet):
+		return self.Registry.Find("ip", packet["payload"]["data"]["ip"])
+
 	# CustomRequestHandlers
 	def StartRecordingHandler(self, sock, packet):
 		print("StartRecordingHandler")
 		# Find camera
-		for item in self.ObjCameras:
-			if (item.GetIp() in packet["payload"]["data"]["ip"]):
-				# TODO - Each camera must have its own directory
-				item.StartRecording()
-				cameras = self.DB["cameras"]
-				for item in cameras:
-					if (item["ip"] in packet["payload"]["data"]["ip"]):
-						item["recording"] = 1
-						self.Node.SetFileContent("db.json", json.dumps(self.DB))
+		entry = self.FindCamera(packet)
+		if entry is not None and entry.Device is not None:
+			entry.Device.StartRecording()
+			entry.Record["recording"] = 1
+			self.Store.Save(self.DB)
 				
 		THIS.Node.LocalServiceNode.SendCustomCommandResponse(sock, packet, {
 			'return_code': 'STARTED'
@@ -430,15 +585,11 @@ class Context():
 	def StopRecordingHandler(self, sock, packet):
 		print("StopRecordingHandler")
 		# Find camera
-		for item in self.ObjCameras:
-			if (item.GetIp() in packet["payload"]["data"]["ip"]):
-				# TODO - Each camera must have its own directory
-				item.StopRecording()
-				cameras = self.DB["cameras"]
-				for item in cameras:
-					if (item["ip"] in packet["payload"]["data"]["ip"]):
-						item["recording"] = 0
-						self.Node.SetFileContent("db.json", json.dumps(self.DB))
+		entry = self.FindCamera(packet)
+		if entry is not None and entry.Device is not None:
+			entry.Device.StopRecording()
+			entry.Record["recording"] = 0
+			self.Store.Save(self.DB)
 		
 		THIS.Node.LocalServiceNode.SendCustomCommandResponse(sock, packet, {
 			'return_code': 'STOPPED'
@@ -446,22 +597,20 @@ class Context():
 
 	def StartMotionDetectionHandler(self, sock, packet):
 		print("StartMotionDetectionHandler")
-		cameras = self.DB["cameras"]
-		for item in cameras:
-			if (item["ip"] in packet["payload"]["data"]["ip"]):
-				item["motion_detection"] = 1
-				self.Node.SetFileContent("db.json", json.dumps(self.DB))
+		entry = self.FindCamera(packet)
+		if entry is not None:
+			entry.Record["motion_detection"] = 1
+			self.Store.Save(self.DB)
 		THIS.Node.LocalServiceNode.SendCustomCommandResponse(sock, packet, {
 			'return_code': 'STARTED'
 		})
 
 	def StopMotionDetectionHandler(self, sock, packet):
 		print("StopMotionDetectionHandler")
-		cameras = self.DB["cameras"]
-		for item in cameras:
-			if (item["ip"] in packet["payload"]["data"]["ip"]):
-				item["motion_detection"] = 0
-				self.Node.SetFileContent("db.json", json.dumps(self.DB))
+		entry = self.FindCamera(packet)
+		if entry is not None:
+			entry.Record["motion_detection"] = 0
+			self.Store.Save(self.DB)
 		THIS.Node.LocalServiceNode.SendCustomCommandResponse(sock, packet, {
 			'return_code': 'STOPPED'
 		})
@@ -470,13 +619,11 @@ class Context():
 		print("StartSecurityHandler")
 		self.DB["security"] = 1
 		self.SecurityEnabled = True
-		cameras = self.DB["cameras"]
-		for item in cameras:
-			item["security"] = 1
-		self.DB["cameras"] = cameras
-		for item in self.ObjCameras:
-			item.StartSecurity()
-		self.Node.SetFileContent("db.json", json.dumps(self.DB))
+		for entry in self.Registry.GetEntries():
+			entry.Record["security"] = 1
+			if entry.Device is not None:
+				entry.Device.StartSecurity()
+		self.Store.Save(self.DB)
 		THIS.Node.LocalServiceNode.SendCustomCommandResponse(sock, packet, {
 			'return_code': 'STARTED'
 		})
@@ -485,13 +632,11 @@ class Context():
 		print("StopSecurityHandler")
 		self.DB["security"] = 0
 		self.SecurityEnabled = False
-		cameras = self.DB["cameras"]
-		for item in cameras:
-			item["security"] = 0
-		for item in self.ObjCameras:
-			item.StopSecurity()
-		self.DB["cameras"] = cameras
-		self.Node.SetFileContent("db.json", json.dumps(self.DB))
+		for entry in self.Registry.GetEntries():
+			entry.Record["security"] = 0
+			if entry.Device is not None:
+				entry.Device.StopSecurity()
+		self.Store.Save(self.DB)
 		THIS.Node.LocalServiceNode.SendCustomCommandResponse(sock, packet, {
 			'return_code': 'STOPPED'
 		})
@@ -502,10 +647,9 @@ class Context():
 	def GetCaptureProgressHandler(self, sock, packet):
 		# Find camera
 		ret = 0
-		for item in self.ObjCameras:
-			if (item.GetIp() in packet["payload"]["data"]["ip"]):
-				ret = item.GetCapturingProcess()
-				break
+		entry = self.FindCamera(packet)
+		if entry is not None and entry.Device is not None:
+			ret = entry.Device.GetCapturingProcess()
 				
 		THIS.Node.LocalServiceNode.SendCustomCommandResponse(sock, packet, {
 			'progress': str(ret)
@@ -522,49 +666,79 @@ class Context():
 	
 	def GetMiscInformationHandler(self, sock, packet):
 		print ("GetMiscInformationHandler")
-		dbCameras = self.DB["cameras"]
-		for itemCamera in dbCameras:
-			if itemCamera["ip"] in packet["payload"]["data"]["ip"]:
-				videosList = os.listdir("videos")
-				THIS.Node.LocalServiceNode.SendCustomCommandResponse(sock, packet, {
-					'frame_per_video': str(itemCamera["frame_per_video"]),
-					'camera_sensetivity_recording': str(itemCamera["camera_sensetivity_recording"]),
-					'face_detect': str(itemCamera["face_detect"]),
-					'video_list': videosList
-				})
-				return
-		
+		entry = self.FindCamera(packet)
+		if entry is None:
+			THIS.Node.LocalServiceNode.SendCustomCommandResponse(sock, packet, {
+				'error': 'bad camera'
+			})
+			return
+
+		itemCamera = entry.Record
+		videosFolder = os.path.join("videos", itemCamera["ip"])
+		videosList = []
+		if os.path.exists(videosFolder):
+			videosList = os.listdir(videosFolder)
 		THIS.Node.LocalServiceNode.SendCustomCommandResponse(sock, packet, {
-			'error': 'bad camera'
+			'frame_per_video': str(itemCamera["frame_per_video"]),
+			'camera_sensetivity_recording': str(itemCamera["camera_sensetivity_recording"]),
+			'face_detect': str(itemCamera["face_detect"]),
+			'seconds_per_video': str(itemCamera.get("seconds_per_video", 0)),
+			'video_codec': itemCamera.get("video_codec", "mpeg4"),
+			'motion_roi': itemCamera.get("motion_roi"),
+			'video_list': videosList
 		})
 
 	def SetMiscInformationHandler(self, sock, packet):
 		print ("SetMiscInformationHandler")
-		dbCameras = self.DB["cameras"]
-		for itemCamera in dbCameras:
-			if itemCamera["ip"] in packet["payload"]["data"]["ip"]:
-				itemCamera["frame_per_video"] = packet["payload"]["data"]["frame_per_video"]
-				itemCamera["camera_sensetivity_recording"] = packet["payload"]["data"]["camera_sensetivity_recording"]
-				itemCamera["face_detect"] = packet["payload"]["data"]["face_detect"]
-
-				self.DB["cameras"] = dbCameras
-				# Save new camera to database
-				self.Node.SetFileContent("db.json", json.dumps(self.DB))
-
-				for item in self.ObjCameras:
-					if (item.GetIp() in packet["payload"]["data"]["ip"]):
-						item.SetFramesPerVideo(int(itemCamera["frame_per_video"]))
-						item.SetRecordingSensetivity(int(itemCamera["camera_sensetivity_recording"]))
-		
-				THIS.Node.LocalServiceNode.SendCustomCommandResponse(sock, packet, {
-					'error': 'success'
-				})
-				return
-		
+		entry = self.FindCamera(packet)
+		if entry is None:
+			THIS.Node.LocalServiceNode.SendCustomCommandResponse(sock, packet, {
+				'error': 'bad camera'
+			})
+			return
+
+		if IsValidRegion(packet["payload"]["data"].get("motion_roi")) is False:
+			THIS.Node.LocalServiceNode.SendCustomCommandResponse(sock, packet, {
+				'error': 'bad motion_roi'
+			})
+			return
+
+		itemCamera = entry.Record
+		itemCamera["frame_per_video"] = packet["payload"]["data"]["frame_per_video"]
+		itemCamera["camera_sensetivity_recording"] = packet["payload"]["data"]["camera_sensetivity_recording"]
+		itemCamera["face_detect"] = packet["payload"]["data"]["face_detect"]
+		if "seconds_per_video" in packet["payload"]["data"]:
+			itemCamera["seconds_per_video"] = packet["payload"]["data"]["seconds_per_video"]
+		if "video_codec" in packet["payload"]["data"]:
+			itemCamera["video_codec"] = packet["payload"]["data"]["video_codec"]
+		if "motion_roi" in packet["payload"]["data"]:
+			itemCamera["motion_roi"] = packet["payload"]["data"]["motion_roi"]
+		# Save new camera to database
+		self.Store.Save(self.DB)
+
+		if entry.Device is not None:
+			self.ApplyCameraSettings(entry.Device, itemCamera)
+
 		THIS.Node.LocalServiceNode.SendCustomCommandResponse(sock, packet, {
-			'error': 'bad camera'
+			'error': 'success'
 		})
 	
+	def GetCameraStatisticsHandler(self, sock, packet):
+		print ("GetCameraStatisticsHandler")
+		statistics = {}
+		for item in self.Registry.GetDevices():
+			statistics[item.GetIp()] = item.GetStatistics()
+
+		THIS.Node.LocalServiceNode.SendCustomCommandResponse(sock, packet, {
+			'statistics': statistics
+		})
+
+	def GetEncoderStatisticsHandler(self, sock, packet):
+		print ("GetEncoderStatisticsHandler")
+		THIS.Node.LocalServiceNode.SendCustomCommandResponse(sock, packet, {
+			'statistics': GEncoder.GetStatistics()
+		})
+
 	# Sending SMS via RESTApi of SMS service Node
 	def SendSMSRequest(self):
 		try:
@@ -645,16 +819,93 @@ class Context():
 	def WSConnectionClosedHandler(self):
 		print ("WSConnectionClosedHandler")
 
+	def ApplyCameraSettings(self, camera, itemCamera):
+		camera.SetFramesPerVideo(int(itemCamera["frame_per_video"]))
+		camera.SetRecordingSensetivity(int(itemCamera["camera_sensetivity_recording"]))
+		camera.SetSecondsPerVideo(int(itemCamera.get("seconds_per_video", 0)))
+		camera.SetVideoCodec(itemCamera.get("video_codec", "mpeg4"))
+		camera.SetMotionRegion(itemCamera.get("motion_roi"))
+
+	# Runs on the discovery thread, only new or moved addresses are fingerprinted.
+	def DiscoverCameras(self):
+		cameras = self.DeviceScanner.Scan("192.168.0.", [1,253])
+		return self.Reconciler.Diff(cameras)
+
+	# Runs on the scanner pool for addresses the registry does not know.
+	def FingerprintCamera(self, ip):
+		if self.HJTScanner.SendRequest(ip) is False:
+			return None
+		camera = HJTCamera(ip)
+		mac = camera.GetMACAddress()
+		if mac == "":
+			return None
+		return {
+			'camera': 	camera,
+			'mac': 		mac,
+			'uid': 		camera.GetUID()
+		}
+
+	# Known cameras get the found IP and are started, unknown ones are saved as new records.
+	def AppendCamera(self, ip, info):
+		camera 	= info["camera"]
+		mac 	= info["mac"]
+		uid 	= info["uid"]
+		print ("[Camera Surveillance]>", "AppendCamera", mac, uid, ip)
+
+		entry = self.Registry.Find("mac", mac)
+		if entry is not None and entry.Device is not None:
+			# Same camera answered on two addresses, keep the running one
+			return
+		if entry is not None and str(uid) == str(entry.Record["uid"]):
+			itemCamera = entry.Record
+			# Update DB with current IP
+			self.Registry.Update(entry, "ip", ip)
+			# Start camera thread
+			camera.StartCamera()
+			# Check weither need to start recording
+			if 1 == itemCamera["recording"]:
+				print ("[Camera Surveillance]>", "Start recording", mac, uid, ip)
+				camera.StartRecording()
+			# If security is ON we need to get frames
+			if self.SecurityEnabled is True:
+				camera.StartSecurity()
+			self.ApplyCameraSettings(camera, itemCamera)
+			camera.OnImageDifferentCallback = self.OnCameraDiffrentHandler
+			self.Registry.Attach(entry, camera)
+			print ("[Camera Surveillance]>", "AppendCamera - True")
+			return
+
+		print ("[Camera Surveillance]>", "AppendCamera - False")
+		# Append new camera.
+		self.Registry.Add({
+						'mac': str(mac),
+						'uid': str(uid),
+						'ip': str(ip),
+						'name': 'Camera_' + str(uid),
+						'enable':1,
+						"frame_per_video": 2000,
+						"camera_sensetivity_recording": 95,
+						"recording": 0,
+						"face_detect": 0,
+						"security": 0,
+						"motion_detection": 0,
+						"status": "disconnected"
+		}, camera)
+		camera.SetFramesPerVideo(2000)
+		camera.SetRecordingSensetivity(95)
+
+	def RemoveCamera(self, entry):
+		# Camera was disconnected
+		print ("[Camera Surveillance]>", "RemoveCamera", entry.Record["ip"])
+		self.Registry.Detach(entry).StopCamera()
+
 	def NodeSystemLoadedHandler(self):
 		print ("NodeSystemLoadedHandler")
 		THIS.Node.LocalServiceNode.GetListOfNodeFromGateway()
 		# Loading local database
-		jsonSensorStr = self.Node.GetFileContent("db.json")
-		if jsonSensorStr != "":
-			self.DB = json.loads(jsonSensorStr)
-			if self.DB is not None:
-				for item in self.DB["cameras"]:
-					self.Cameras.append(item)
+		self.DB = self.Store.Load()
+		if self.DB is not None:
+			self.Registry.Load(self.DB["cameras"])
 
 		# Create file system for storing videos
 		if not os.path.exists(".videos"):
@@ -664,70 +915,8 @@ class Context():
 		if self.DB["security"] == 1:
 			self.SecurityEnabled = True
 
-		# Search for cameras and update local database
-		cameras = self.DeviceScanner.Scan("192.168.0.", [1,253])
-		HJTScanner = HJTCameraScanner()
-		ips = HJTScanner.Scan(cameras)
-		# Foreach camera,
-		#	1. Get UID and MAC.
-		#	2. Check DB if MAC and UID exist, is so save found IP.
-		#	3. If camera does not exist, save it.
-		dbCameras = self.DB["cameras"]
-		for ip in ips:
-			camera = HJTCamera(ip)
-			mac = camera.GetMACAddress()
-			uid = camera.GetUID()
-			print ("[Camera Surveillance]>", "NodeSystemLoadedHandler", mac, uid, ip)
-
-			cameraFound = False
-			# Update camera IP (if it was changed)
-			for itemCamera in dbCameras:
-				if uid in itemCamera["uid"] and mac in itemCamera["mac"]:
-					# Update DB with current IP
-					itemCamera["ip"] = ip
-					# Start camera thread
-					camera.StartCamera()
-					# Check weither need to start recording
-					if 1 == itemCamera["recording"]:
-						print ("[Camera Surveillance]>", "Start recording", mac, uid, ip)
-						camera.StartRecording()
-					# If security is ON we need to get frames
-					if self.SecurityEnabled is True:
-						camera.StartSecurity()
-					camera.SetFramesPerVideo(int(itemCamera["frame_per_video"]))
-					camera.SetRecordingSensetivity(int(itemCamera["camera_sensetivity_recording"]))
-					camera.OnImageDifferentCallback = self.OnCameraDiffrentHandler
-					# Add camera to camera obejct DB
-					self.ObjCameras.append(camera)
-					cameraFound = True
-					print ("[Camera Surveillance]>", "NodeSystemLoadedHandler - True")
-					break
-			
-			if cameraFound is False:
-				print ("[Camera Surveillance]>", "NodeSystemLoadedHandler - False")
-				# Append new camera.
-				dbCameras.append({
-								'mac': str(mac),
-								'uid': str(uid),
-								'ip': str(ip),
-								'name': 'Camera_' + str(uid),
-								'enable':1,
-								"frame_per_video": 2000,
-								"camera_sensetivity_recording": 95,
-								"recording": 0,
-								"face_detect": 0,
-								"security": 0,
-								"motion_detection": 0,
-								"status": "disconnected"
-				})
-				camera.SetFramesPerVideo(2000)
-				camera.SetRecordingSensetivity(95)
-				# Add camera to camera obejct DB
-				self.ObjCameras.append(camera)
-		self.DB["cameras"] = dbCameras
-		# Save new camera to database
-		self.Node.SetFileContent("db.json", json.dumps(self.DB))
-		self.HJTDetectorTimestamp = time.time()
+		# Search for cameras in the background, results are applied by WorkingHandler
+		self.Discovery.Run()
 	
 	def OnMasterFoundHandler(self, masters):
 		print ("OnMasterFoundHandler")
@@ -768,10 +957,8 @@ class Context():
 		print ("OnSetSensorInfoRequestHandler")
 	
 	def OnCustomCommandRequestHandler(self, sock, json_data):
-		print ("OnCustomCommandRequestHandler")
-		command = json_data['command']
-		if command in self.CustomRequestHandlers:
-			self.CustomRequestHandlers[command](sock, json_data)
+		LOG.debug("OnCustomCommandRequestHandler %s", json_data['command'])
+		self.Commands.Dispatch(sock, json_data)
 
 	def OnCustomCommandResponseHandler(self, sock, json_data):
 		print ("OnCustomCommandResponseHandler")
@@ -858,96 +1045,31 @@ class Context():
 
 	def WorkingHandler(self):
 		if time.time() - self.CurrentTimestamp > self.Interval:
-			print ("WorkingHandler")
+			LOG.debug("WorkingHandler")
 
 			self.CheckingForUpdate = True
 			self.CurrentTimestamp = time.time()
 
 			for idx, item in enumerate(THIS.Node.LocalServiceNode.GetConnections()):
-				print ("  ", str(idx), item.LocalType, item.UUID, item.IP, item.Port, item.Type)
-			
-		if time.time() - self.HJTDetectorTimestamp > 60 * 1:
-			# Search for cameras and update local database
-			cameras = self.DeviceScanner.Scan("192.168.0.", [1,253])
-			HJTScanner = HJTCameraScanner()
-			ips = HJTScanner.Scan(cameras)
-			# Foreach camera,
-			#	1. Get UID and MAC.
-			#	2. Check DB if MAC and UID exist, is so save found IP.
-			#	3. If camera does not exist, save it.
-			dbCameras = self.DB["cameras"]
-
-			# Remove disconnected devices
-			for camera in self.ObjCameras:
-				if (camera.GetIp() not in ips):
-					# Camera was disconnected
-					print ("DELETED <-------------------------->", camera.GetIp())
-					self.ObjCameras.remove(camera)
+				LOG.debug("  %s %s %s %s %s %s", idx, item.LocalType, item.UUID, item.IP, item.Port, item.Type)
 			
-			return
-			for ip in ips:
-				camera = HJTCamera(ip)
-				mac = camera.GetMACAddress()
-				uid = camera.GetUID()
-				print ("[Camera Surveillance]>", "NodeSystemLoadedHandler", mac, uid, ip)
-
-				cameraFound = False
-				# Update camera IP (if it was changed)
-				for itemCamera in dbCameras:
-					if uid in itemCamera["uid"] and mac in itemCamera["mac"]:
-						# Update DB with current IP
-						itemCamera["ip"] = ip
-						camera.SetState(int(itemCamera["state"]))
-						camera.StartCamera()
-						# Check weither need to start recording
-						if 1 == itemCamera["recording"]:
-							print ("[Camera Surveillance]>", "Start recording", mac, uid, ip)
-							camera.StartRecording()
-						# If security is ON we need to get frames
-						if self.SecurityEnabled is True:
-							camera.StartSecurity()
-						camera.SetFramesPerVideo(int(itemCamera["frame_per_video"]))
-						camera.SetRecordingSensetivity(int(itemCamera["camera_sensetivity_recording"]))
-						camera.OnImageDifferentCallback = self.OnCameraDiffrentHandler
-						# Add camera to camera obejct DB
-						self.ObjCameras.append(camera)
-						cameraFound = True
-						print ("[Camera Surveillance]>", "NodeSystemLoadedHandler - True")
-						break
-				
-				if cameraFound is False:
-					print ("[Camera Surveillance]>", "NodeSystemLoadedHandler - False")
-					# Append new camera.
-					dbCameras.append({
-									'mac': str(mac),
-									'uid': str(uid),
-									'ip': str(ip),
-									'name': 'Camera_' + str(uid),
-									'enable':1,
-									"frame_per_video": 2000,
-									"camera_sensetivity_recording": 95,
-									"recording": 0,
-									"face_detect": 0,
-									"security": 0,
-									"motion_detection": 0,
-									"status": "disconnected"
-					})
-					camera.SetFramesPerVideo(2000)
-					camera.SetRecordingSensetivity(95)
-					# Add camera to camera obejct DB
-					self.ObjCameras.append(camera)
-			self.DB["cameras"] = dbCameras
-			# Save new camera to database
-			self.Node.SetFileContent("db.json", json.dumps(self.DB))
+		# Update cameras and local database with the background scans
+		for appended, removed in self.Discovery.GetResults():
+			appendedIps, removedIps = self.Reconciler.Apply(appended, removed)
+			if len(appendedIps) > 0 or len(removedIps) > 0:
+				print ("[Camera Surveillance]>", "Rescan", appendedIps, removedIps)
+				self.Store.Save(self.DB)
 
 Service = MkSSlaveNode.SlaveNode()
 Node 	= MkSNode.Node("Camera Surveillance", Service)
 THIS 	= Context(Node)
 
 def signal_handler(signal, frame):
+	THIS.Discovery.Stop()
 	THIS.Node.Stop()
 
 def main():
+	MkSLogger.Setup("camera")
 	signal.signal(signal.SIGINT, signal_handler)
 	THIS.Node.SetLocalServerStatus(True)
 	
@@ -977,6 +1099,9 @@ def main():
 	THIS.Node.LocalServiceNode.OnMasterRemoveNodeCallback			= THIS.OnMasterRemoveNodeHandler
 	
 	THIS.Node.Run(THIS.WorkingHandler)
+	THIS.Discovery.Stop()
+	THIS.Store.Close()
+	MkSLogger.Flush()
 	print ("Exit Node ...")
 
 if __name__ == "__main__":
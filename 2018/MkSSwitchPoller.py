@@ -0,0 +1,106 @@
+#!/usr/bin/python
+import time
+import logging
+import threading
+import Queue
+
+from mkscommon import MkSWakeEvent
+from mkscommon import MkSLogger
+
+LOG 	= logging.getLogger("sonoff.poller")
+SAMPLED = MkSLogger.Sampled(LOG, 60)
+
+# Reads the state of every attached switch on the worker pool, so toggles made
+# at the wall are seen. Polling speeds up to MinInterval after a change and
+# slows down towards MaxInterval while nothing changes. Changes are kept in a
+# versioned table and queued for the node thread, see GetChanges.
+#
+#   read(device) 	- returns 0/1, or None when the device did not answer
+class SwitchPoller():
+	def __init__(self, registry, pool, read, min_interval=2, max_interval=30, timeout=3):
+		self.ObjName 		= "SwitchPoller"
+		self.Registry 		= registry
+		self.Pool 			= pool
+		self.Read 			= read
+		self.MinInterval 	= min_interval
+		self.MaxInterval 	= max_interval
+		self.Interval 		= min_interval
+		self.Timeout 		= timeout
+		self.Version 		= 0
+		self.States 		= {} # id -> { 'state': 0/1, 'version': n }
+		self.Lock 			= threading.Lock()
+		self.Changes 		= Queue.Queue()
+		self.WakeEvent 		= MkSWakeEvent.WakeEvent()
+		self.IsRunning 		= False
+
+	def Run(self):
+		if self.IsRunning is True:
+			return
+		self.IsRunning = True
+		worker = threading.Thread(target=self.PollerThread, name=self.ObjName)
+		worker.daemon = True
+		worker.start()
+
+	def Stop(self):
+		self.IsRunning = False
+		self.WakeEvent.set()
+
+	# Poll again now at the fastest rate, e.g. after the node switched devices.
+	def Touch(self):
+		self.Interval = self.MinInterval
+		self.WakeEvent.set()
+
+	def Poll(self):
+		entries = [entry for entry in self.Registry.GetEntries() if entry.Device is not None]
+		if len(entries) == 0:
+			return []
+		states = self.Pool.Map(lambda entry: self.Read(entry.Device), entries, self.Timeout)
+
+		changed = []
+		self.Lock.acquire()
+		for entry, state in zip(entries, states):
+			if state is None:
+				continue
+			id = entry.Record["id"]
+			item = self.States.get(id)
+			if item is not None and item["state"] == state:
+				continue
+			self.Version += 1
+			self.States[id] = { 'state': state, 'version': self.Version }
+			changed.append((entry, state))
+		self.Lock.release()
+		return changed
+
+	def PollerThread(self):
+		while self.IsRunning is True:
+			try:
+				changed = self.Poll()
+			except Exception as e:
+				SAMPLED.warning("poll", "[%s] Exception %s", self.ObjName, e)
+				changed = []
+
+			if len(changed) > 0:
+				self.Changes.put(changed)
+				self.Interval = self.MinInterval
+			else:
+				self.Interval = min(self.Interval * 1.5, self.MaxInterval)
+
+			self.WakeEvent.wait(self.Interval)
+			self.WakeEvent.clear()
+
+	# Non blocking, returns the list of [(entry, state)] changes found since the last call.
+	def GetChanges(self):
+		changes = []
+		while True:
+			try:
+				changes.extend(self.Changes.get(block=False))
+			except Queue.Empty:
+				return changes
+
+	# Returns (version, { id: state }) of the switches changed after the given version.
+	def GetStates(self, since=0):
+		self.Lock.acquire()
+		states = dict((id, item["state"]) for id, item in self.States.items() if item["version"] > since)
+		version = self.Version
+		self.Lock.release()
+		return version, states
@@ -8,12 +8,6 @@ import time
 import thread
 import threading
 import logging
-logging.basicConfig(
-	filename='app.log',
-	level=logging.DEBUG,
-    format='%(asctime)s.%(msecs)03d %(levelname)s %(module)s - %(funcName)s: %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S',
-)
 
 import subprocess
 import urllib2
@@ -26,58 +20,24 @@ from mksdk import MkSLocalHWConnector
 from mksdk import MkSUSBAdaptor
 from mksdk import MkSProtocol
 
+from mkscommon import MkSDeviceScanner
+from mkscommon import MkSJSONStore
+from mkscommon import MkSDeviceRegistry
+from mkscommon import MkSDeviceReconciler
+from mkscommon import MkSDiscoveryScheduler
+from mkscommon import MkSHTTPClient
+from mkscommon import MkSWorkerPool
+from mkscommon import MkSNodeCommands
+from mkscommon import MkSLogger
+
 from flask import Response, request
 
-class EthernetDeviceScanner():
-	def __init__(self):
-		self.ObjName 			= "EthernetDeviceScanner"
-		self.IPList				= []
-		self.ThreadCounter 		= 0
-		self.ThreadCounterLock	= threading.Lock()
-
-	def Ping(self, address):
-		response = subprocess.call("ping -c 1 %s" % address,
-				shell=True,
-				stdout=open('/dev/null', 'w'),
-				stderr=subprocess.STDOUT)
-		# Check response
-		if response == 0:
-			return True
-		else:
-			return False
-	
-	def PingThread(self, address):
-		res = self.Ping(address)
-		self.ThreadCounterLock.acquire()
-		if True == res:
-			self.IPList.append(address)
-		self.ThreadCounter += 1
-		self.ThreadCounterLock.release()
-
-	def Scan(self, network, index):
-		self.ThreadCounter 		= 0
-		self.Network		 	= network
-		self.IPCount 			= index[1] - index[0]
-		self.IPList 			= []
-
-		if (self.IPCount < 0):
-			return []
-		
-		for i in range(index[0], index[1]):
-			address = self.Network + str(i)
-			thread.start_new_thread(self.PingThread, (address,))
-		
-		while (self.ThreadCounter != self.IPCount):
-			pass
-		
-		return self.IPList
+import MkSSwitchPoller
 
 class SonoffScanner():
-	def __init__(self):
+	def __init__(self, scanner):
 		self.ObjName 			= "SonoffScanner"
-		self.Devices			= []
-		self.ThreadCounter 		= 0
-		self.ThreadCounterLock	= threading.Lock()
+		self.Scanner			= scanner
 
 	def SendRequest(self, url):
 		try:
@@ -91,46 +51,22 @@ class SonoffScanner():
 		
 		return False
 	
-	def RequestThread(self, address):
-		res = self.SendRequest(address)
-		self.ThreadCounterLock.acquire()
-		if True == res:
-			self.Devices.append(address)
-		self.ThreadCounter += 1
-		self.ThreadCounterLock.release()
-
 	def Scan(self, addresses):
-		self.ThreadCounter 		= 0
-		self.CamerasCount 		= len(addresses)
-		self.Devices 			= []
-
-		if (self.CamerasCount < 0):
-			return []
-		
-		for ip in addresses:
-			thread.start_new_thread(self.RequestThread, (ip,))
-		
-		while (self.ThreadCounter != self.CamerasCount):
-			pass
-		
-		return self.Devices
+		return self.Scanner.Probe(addresses, self.SendRequest)
 
 class Sonoff():
 	def __init__(self, ip):
 		self.Address 	= ip
 		self.Id 		= ""
 		self.State 		= 0
+		# Keep-alive connection, no TCP handshake per on/off/id request
+		self.HTTP 		= MkSHTTPClient.HTTPClient(ip, timeout=2, connections=1)
 	
 	def SonnofRequest(self, request):
-		try:
-			res = urllib2.urlopen("http://" + self.Address + "/" + request, timeout = 2).read()
-			return res
-		except urllib2.HTTPError as e:
+		res, error = self.HTTP.Get("/" + request)
+		if error is True:
 			return ""
-		except:
-			pass
-		
-		return ""
+		return res
 	
 	def GetSwitchID(self):
 		res = self.SonnofRequest("id")
@@ -161,10 +97,29 @@ class Sonoff():
 	
 	def SetState(self, state):
 		self.State = state
+
+	# Relay state as reported by the device, None when it did not answer.
+	def ReadState(self):
+		res = self.SonnofRequest("state")
+		if "off" in res:
+			self.State = 0
+		elif "on" in res:
+			self.State = 1
+		else:
+			return None
+		return self.State
+
+	# Switch to the given state, returns True when the device confirmed it.
+	def Apply(self, state):
+		if int(state) == 0:
+			return "off" in self.SetSwitchOff()
+		return "on" in self.SetSwitchOn()
 	
 	def GetState(self):
 		return self.State
 
+LOG = logging.getLogger("sonoff")
+
 class Context():
 	def __init__(self, node):
 		self.Interval					= 10
@@ -180,33 +135,65 @@ class Context():
 		self.CustomRequestHandlers				= {
 			'switch_on': 							self.SwitchOnHandler,
 			'switch_off': 							self.SwitchOffHandler,
+			'set_switches':							self.SetSwitchesHandler,
+			'get_scenes':							self.GetScenesHandler,
+			'set_group':							self.SetGroupHandler,
+			'set_scene':							self.SetSceneHandler,
+			'apply_scene':							self.ApplySceneHandler,
+			'get_switch_states':					self.GetSwitchStatesHandler,
 		}
+		# Measured handlers, get_node_metrics and the dispatcher pool for slow handlers
+		self.Commands 							= MkSNodeCommands.NodeCommands(self.Node, self.Handlers, self.CustomRequestHandlers)
+		self.Commands.Offload('switch_on', concurrency=4, group='switch')
+		self.Commands.Offload('switch_off', concurrency=4, group='switch')
+		self.Commands.Offload('set_switches', concurrency=2)
+		self.Commands.Offload('apply_scene', concurrency=2)
 		self.CustomResponseHandlers				= {
 		}
 
 		self.DB							= None
-		self.DeviceScanner 				= EthernetDeviceScanner()
-		self.Switches 					= []
-		self.ObjSwitches				= []
+		self.Store 						= MkSJSONStore.JSONStore("db.json")
+		self.DeviceScanner 				= MkSDeviceScanner.DeviceScanner()
+		self.SonoffScanner 				= SonoffScanner(self.DeviceScanner)
+		self.Registry 					= MkSDeviceRegistry.DeviceRegistry(["ip", "id"])
+		self.Reconciler 				= MkSDeviceReconciler.DeviceReconciler(self.Registry, self.DeviceScanner, self.FingerprintSwitch)
+		self.Reconciler.OnDeviceAppend 	= self.AppendSwitch
+		self.Reconciler.OnDeviceRemove 	= self.RemoveSwitch
+		# Switch writes fan out on this pool, one HTTP request per device at a time
+		self.SwitchPool 				= MkSWorkerPool.WorkerPool(16, "SwitchPool")
+		self.SwitchTimeout 				= 3
+		# Unreachable switches fail every write, one line per switch and interval
+		self.SwitchLog 					= MkSLogger.Sampled(LOG, 30)
+		# Saved states of switches found by the last rescan, applied together
+		self.PendingStates 				= []
+		self.Poller 					= MkSSwitchPoller.SwitchPoller(self.Registry, self.SwitchPool, Sonoff.ReadState)
 		self.SensorChange				= 0
-		self.SonoffDetectorTimestamp	= time.time()
-		self.ScanedIPs 					= []
+		self.Discovery 					= MkSDiscoveryScheduler.DiscoveryScheduler(self.DiscoverSwitches, 60)
 	
 	def UndefindHandler(self, message_type, source, data):
 		print ("UndefindHandler")
 	
+	# Registry entry of an attached switch, None when the switch is not connected.
+	def FindSwitch(self, packet):
+		entry = self.Registry.Find("ip", packet["payload"]["data"]["ip"])
+		if entry is None or entry.Device is None:
+			return None
+		return entry
+
 	# CustomRequestHandlers
 	def SwitchOnHandler(self, sock, packet):
 		print("SwitchOnHandler")
-		for item in self.ObjSwitches:
-			if (item.GetIp() in packet["payload"]["data"]["ip"]):
-				res = item.SetSwitchOn()
-				if ("on" in res):
-					self.SensorChange += 1
-					THIS.Node.LocalServiceNode.SendCustomCommandResponse(sock, packet, {
-						'return_code': 'on'
-					})
-					return
+		entry = self.FindSwitch(packet)
+		if entry is not None:
+			res = entry.Device.SetSwitchOn()
+			if ("on" in res):
+				entry.Record["state"] = entry.Device.GetState()
+				self.SensorChange += 1
+				self.Poller.Touch()
+				THIS.Node.LocalServiceNode.SendCustomCommandResponse(sock, packet, {
+					'return_code': 'on'
+				})
+				return
 		
 		THIS.Node.LocalServiceNode.SendCustomCommandResponse(sock, packet, {
 			'return_code': 'error'
@@ -214,20 +201,79 @@ class Context():
 	
 	def SwitchOffHandler(self, sock, packet):
 		print("SwitchOffHandler")
-		for item in self.ObjSwitches:
-			if (item.GetIp() in packet["payload"]["data"]["ip"]):
-				res = item.SetSwitchOff()
-				if ("off" in res):
-					self.SensorChange += 1
-					THIS.Node.LocalServiceNode.SendCustomCommandResponse(sock, packet, {
-						'return_code': 'on'
-					})
-					return
+		entry = self.FindSwitch(packet)
+		if entry is not None:
+			res = entry.Device.SetSwitchOff()
+			if ("off" in res):
+				entry.Record["state"] = entry.Device.GetState()
+				self.SensorChange += 1
+				self.Poller.Touch()
+				THIS.Node.LocalServiceNode.SendCustomCommandResponse(sock, packet, {
+					'return_code': 'off'
+				})
+				return
 		
 		THIS.Node.LocalServiceNode.SendCustomCommandResponse(sock, packet, {
 			'return_code': 'error'
 		})
 
+	# Runs on the switch pool, a failed request is an error, not a timeout.
+	def ApplyState(self, item):
+		switch, state = item
+		try:
+			return switch.Apply(state)
+		except Exception as e:
+			self.SwitchLog.warning(switch.GetIp(), "[Switch] ApplyState %s %s", switch.GetIp(), e)
+			return False
+
+	# Apply [(switch, state)] concurrently. Returns one return code per item:
+	# 'ok', 'error' or 'timeout' when the device did not answer in time.
+	def ApplyStates(self, items, timeout=None):
+		if len(items) == 0:
+			return []
+		if timeout is None:
+			timeout = self.SwitchTimeout
+		results = self.SwitchPool.Map(self.ApplyState, items, timeout)
+		codes = []
+		for result in results:
+			if result is None:
+				codes.append('timeout')
+			elif result is True:
+				codes.append('ok')
+			else:
+				codes.append('error')
+		if 'ok' in codes:
+			self.SensorChange += 1
+			# Changed switches are picked up (and pushed) by the next poll
+			self.Poller.Touch()
+		return codes
+
+	# payload: { 'switches': [{ 'ip': ..., 'state': 0/1 }], 'timeout': seconds }
+	def SetSwitchesHandler(self, sock, packet):
+		print("SetSwitchesHandler")
+		data 	= packet["payload"]["data"]
+		items 	= []
+		found 	= []
+		results = []
+		for item in data["switches"]:
+			result = {
+				'ip': 			item["ip"],
+				'state': 		int(item["state"]),
+				'return_code': 	'not_found'
+			}
+			results.append(result)
+			switch = self.Registry.FindDevice("ip", item["ip"])
+			if switch is not None:
+				items.append((switch, result["state"]))
+				found.append(result)
+
+		for result, code in zip(found, self.ApplyStates(items, data.get("timeout"))):
+			result["return_code"] = code
+
+		THIS.Node.LocalServiceNode.SendCustomCommandResponse(sock, packet, {
+			'results': results
+		})
+
 	# Websockets
 	def WSDataArrivedHandler(self, message_type, source, data):
 		command = data['device']['command']
@@ -239,67 +285,212 @@ class Context():
 	def WSConnectionClosedHandler(self):
 		print ("WSConnectionClosedHandler")
 
+	# Runs on the discovery thread, only new or moved addresses are fingerprinted.
+	def DiscoverSwitches(self):
+		devices = self.DeviceScanner.Scan("192.168.0.", [1,200])
+		return self.Reconciler.Diff(devices)
+
+	# Runs on the scanner pool for addresses the registry does not know.
+	def FingerprintSwitch(self, ip):
+		if self.SonoffScanner.SendRequest(ip) is False:
+			return None
+		switch = Sonoff(ip)
+		return {
+			'switch': 	switch,
+			'id': 		switch.GetSwitchID()
+		}
+
+	# Known switches get the found IP and their saved state, unknown ones are saved as new records.
+	def AppendSwitch(self, ip, info):
+		switch 	= info["switch"]
+		id 		= info["id"]
+		print ("[Switch]>", "AppendSwitch", id, ip)
+
+		entry = None
+		if id != "":
+			entry = self.Registry.Find("id", id)
+		if entry is not None and entry.Device is not None:
+			# Same switch answered on two addresses, keep the known one
+			return
+		if entry is not None:
+			# Update DB with current IP
+			self.Registry.Update(entry, "ip", ip)
+			switch.SetState(int(entry.Record["state"]))
+			# Restored together with the other found switches, see RestoreStates
+			self.PendingStates.append((switch, switch.GetState()))
+			entry.Record["status"] = "connected"
+			self.Registry.Attach(entry, switch)
+			print ("[Switch]>", "AppendSwitch - Switch UPDATED")
+			return
+
+		print ("[Switch]>", "AppendSwitch - NEW SWITCH")
+		# Append new switch.
+		self.Registry.Add({
+						'id': str(id),
+						'ip': str(ip),
+						'name': 'Switch_' + str(id),
+						'enable':1,
+						'mac': 'AA:AA:AA:AA:AA:AA',
+						'state': 0,
+						'status': 'connected'
+		}, switch)
+
+	def FindNamed(self, key, name):
+		for item in self.DB[key]:
+			if item["name"] == name:
+				return item
+		return None
+
+	# Replace (or remove when value is None) a named DB["groups"]/DB["scenes"] item.
+	def SetNamed(self, key, name, field, value):
+		item = self.FindNamed(key, name)
+		if item is not None:
+			self.DB[key].remove(item)
+		if value is not None:
+			self.DB[key].append({ 'name': name, field: value })
+		self.Store.Save(self.DB)
+
+	# Scene actions ({ 'group': name, 'state': s } or { 'switch': id, 'state': s })
+	# to an ordered [(id, state)], later actions win over earlier ones. Returns
+	# the switches and the names of unknown groups.
+	def ResolveActions(self, actions):
+		states 	= {}
+		order 	= []
+		missing = []
+		for action in actions:
+			if "group" in action:
+				group = self.FindNamed("groups", action["group"])
+				if group is None:
+					missing.append(action["group"])
+					continue
+				ids = group["switches"]
+			else:
+				ids = [action["switch"]]
+			for id in ids:
+				if id not in states:
+					order.append(id)
+				states[id] = int(action["state"])
+		return [(id, states[id]) for id in order], missing
+
+	def GetScenesHandler(self, sock, packet):
+		THIS.Node.LocalServiceNode.SendCustomCommandResponse(sock, packet, {
+			'groups': self.DB["groups"],
+			'scenes': self.DB["scenes"]
+		})
+
+	# payload: { 'name': ..., 'switches': [id, ...] }, no switches removes the group
+	def SetGroupHandler(self, sock, packet):
+		data = packet["payload"]["data"]
+		self.SetNamed("groups", data["name"], "switches", data.get("switches"))
+		THIS.Node.LocalServiceNode.SendCustomCommandResponse(sock, packet, {
+			'error': 'ok'
+		})
+
+	# payload: { 'name': ..., 'actions': [...] }, no actions removes the scene
+	def SetSceneHandler(self, sock, packet):
+		data = packet["payload"]["data"]
+		self.SetNamed("scenes", data["name"], "actions", data.get("actions"))
+		THIS.Node.LocalServiceNode.SendCustomCommandResponse(sock, packet, {
+			'error': 'ok'
+		})
+
+	# payload: { 'name': scene } or { 'actions': [...] }, optional 'timeout' and
+	# 'force' (also write switches already in the requested state).
+	def ApplySceneHandler(self, sock, packet):
+		print("ApplySceneHandler")
+		data = packet["payload"]["data"]
+		actions = data.get("actions")
+		if actions is None:
+			scene = self.FindNamed("scenes", data.get("name"))
+			if scene is None:
+				THIS.Node.LocalServiceNode.SendCustomCommandResponse(sock, packet, {
+					'error': 'bad scene'
+				})
+				return
+			actions = scene["actions"]
+
+		force 	= data.get("force", False)
+		items 	= []
+		pending = []
+		switches, missing = self.ResolveActions(actions)
+		results = [{ 'group': name, 'return_code': 'not_found' } for name in missing]
+		for id, state in switches:
+			result = {
+				'id': 			id,
+				'state': 		state,
+				'return_code': 	'not_found'
+			}
+			results.append(result)
+			switch = self.Registry.FindDevice("id", id)
+			if switch is None:
+				continue
+			if force is False and switch.GetState() == state:
+				result["return_code"] = 'unchanged'
+				continue
+			items.append((switch, state))
+			pending.append(result)
+
+		for result, code in zip(pending, self.ApplyStates(items, data.get("timeout"))):
+			result["return_code"] = code
+
+		THIS.Node.LocalServiceNode.SendCustomCommandResponse(sock, packet, {
+			'results': results
+		})
+
+	# payload: { 'version': n }, answers with the switches changed after it
+	def GetSwitchStatesHandler(self, sock, packet):
+		version, states = self.Poller.GetStates(int(packet["payload"]["data"].get("version", 0)))
+		THIS.Node.LocalServiceNode.SendCustomCommandResponse(sock, packet, {
+			'version': 	version,
+			'states': 	states
+		})
+
+	# Keep records current with the poller so sensor info is served from memory.
+	def ApplyPolledStates(self):
+		records = []
+		for entry, state in self.Poller.GetChanges():
+			entry.Record["state"] = state
+			records.append(entry.Record)
+		if len(records) > 0:
+			self.Store.Save(self.DB)
+			THIS.Node.LocalServiceNode.SendSensorInfoChange(records)
+
+	# Restore in the background, the node thread does not wait for the switches.
+	def RestoreStates(self):
+		items = self.PendingStates
+		self.PendingStates = []
+		if len(items) == 0:
+			return
+		worker = threading.Thread(target=self.RestoreStatesThread, args=(items,), name="RestoreStates")
+		worker.daemon = True
+		worker.start()
+
+	def RestoreStatesThread(self, items):
+		for (switch, state), code in zip(items, self.ApplyStates(items)):
+			if code != 'ok':
+				self.SwitchLog.warning(switch.GetIp(), "[Switch] RestoreStates %s %s", switch.GetIp(), code)
+
+	def RemoveSwitch(self, entry):
+		# Switch was disconnected
+		print ("[Switch]>", "RemoveSwitch", entry.Record["ip"])
+		entry.Record["status"] = "disconnected"
+		self.Registry.Detach(entry)
+
 	def NodeSystemLoadedHandler(self):
 		print ("NodeSystemLoadedHandler")
 		# Loading local database
-		jsonSensorStr = self.Node.GetFileContent("db.json")
-		if jsonSensorStr != "":
-			self.DB = json.loads(jsonSensorStr)
-			if self.DB is not None:
-				for item in self.DB["switches"]:
-					self.Switches.append(item)
-		
-		devices = self.DeviceScanner.Scan("192.168.0.", [1,200])
-		print(devices)
-		
-		scanner = SonoffScanner()
-		self.ScanedIPs = scanner.Scan(devices)
-		print(self.ScanedIPs)
-		
-		dbSwitches = self.DB["switches"]
-		for ip in self.ScanedIPs:
-			switch = Sonoff(ip)
-			id = switch.GetSwitchID()
-			print ("[Switch]>", "NodeSystemLoadedHandler", id, ip)
-			
-			switchFound = False
-			# Update switch IP (if it was changed)
-			for itemSwitch in dbSwitches:
-				if id != "" and id in itemSwitch["id"]:
-					# Update DB with current IP
-					itemSwitch["ip"] = ip
-					switch.SetState(int(itemSwitch["state"]))
-					
-					if (switch.GetState == 0):
-						switch.SetSwitchOff()
-					else:
-						switch.SetSwitchOn()
-					
-					self.ObjSwitches.append(switch)
-					print ("APPEND SWITCH", ip)
-					switchFound = True
-					print ("[Switch]>", "NodeSystemLoadedHandler - Switch UPDATED")
-					break
-			
-			if switchFound is False:
-				print ("[Switch]>", "NodeSystemLoadedHandler - NEW SWITCH")
-				# Append new switch.
-				dbSwitches.append({
-								'id': str(id),
-								'ip': str(ip),
-								'name': 'Switch_' + str(id),
-								'enable':1,
-								'mac': 'AA:AA:AA:AA:AA:AA',
-								'state': 0,
-								'status': 'connected'
-				})
-				print ("APPEND SWITCH", ip)
-				self.ObjSwitches.append(switch)
+		self.DB = self.Store.Load()
+		if self.DB is not None:
+			self.DB.setdefault("groups", [])
+			self.DB.setdefault("scenes", [])
+			# Nothing is connected until discovery or the poller finds it
+			for record in self.DB["switches"]:
+				record["status"] = "disconnected"
+			self.Registry.Load(self.DB["switches"])
 		
-		self.DB["switches"] = dbSwitches
-		# Save new switch to database
-		self.Node.SetFileContent("db.json", json.dumps(self.DB))
-		self.SonoffDetectorTimestamp = time.time()
+		# Search for switches in the background, results are applied by WorkingHandler
+		self.Discovery.Run()
+		self.Poller.Run()
 	
 	def OnMasterFoundHandler(self, masters):
 		print ("OnMasterFoundHandler")
@@ -324,35 +515,18 @@ class Context():
 
 	def OnGetSensorInfoRequestHandler(self, packet, sock):
 		print ("OnGetSensorInfoRequestHandler")
-		dbSwitches = self.DB["switches"]
-		
-		for dbSwitch in dbSwitches:
-			switchActive = False
-			for switch in self.ObjSwitches:
-				if (switch.GetIp() in dbSwitch["ip"]):
-					dbSwitch["state"] = switch.GetState()
-					dbSwitch["status"] = "connected"
-					switchActive = True
-					break
-			
-			if (switchActive is False):
-				dbSwitch["status"] = "disconnected"
-		
-		self.DB["switches"] = dbSwitches
+		# Records are kept current by the poller and the rescans
 		payload = {
 			'db': self.DB
 		}
-		print (payload)
 		THIS.Node.LocalServiceNode.SendSensorInfoResponse(sock, packet, payload)
 
 	def OnSetSensorInfoRequestHandler(self, packet, sock):
 		print ("OnSetSensorInfoRequestHandler")
 	
 	def OnCustomCommandRequestHandler(self, sock, json_data):
-		print ("OnCustomCommandRequestHandler")
-		command = json_data['command']
-		if command in self.CustomRequestHandlers:
-			self.CustomRequestHandlers[command](sock, json_data)
+		LOG.debug("OnCustomCommandRequestHandler %s", json_data['command'])
+		self.Commands.Dispatch(sock, json_data)
 
 	def OnCustomCommandResponseHandler(self, sock, json_data):
 		print ("OnCustomCommandResponseHandler")
@@ -387,7 +561,7 @@ class Context():
 		THIS.Node.LocalServiceNode.AppendFaceRestTable(endpoint="/set/node_sensor_info/<key>/<id>/<value>", 	endpoint_name="set_node_sensor_value", 	handler=THIS.SetSensorInfoHandler)
 
 	def ScanSonoff(self):
-		scanner 	= SonoffScanner()
+		scanner 	= SonoffScanner(self.DeviceScanner)
 		dbSwitches 	= self.DB["switches"]
 		
 		# Scan network
@@ -400,106 +574,46 @@ class Context():
 	
 	def WorkingHandler(self):
 		if time.time() - self.CurrentTimestamp > self.Interval:
-			print ("WorkingHandler")
+			LOG.debug("WorkingHandler")
 
 			self.CheckingForUpdate = True
 			self.CurrentTimestamp = time.time()
 
 			for idx, item in enumerate(THIS.Node.LocalServiceNode.GetConnections()):
-				print ("  ", str(idx), item.LocalType, item.UUID, item.IP, item.Port, item.Type)
+				LOG.debug("  %s %s %s %s %s %s", idx, item.LocalType, item.UUID, item.IP, item.Port, item.Type)
 			
 			if (self.SensorChange > 0):
 				# Save data to DB
 				print ("Saving sensor data to DB")
-				dbSwitches = self.DB["switches"]
-				for switch in self.ObjSwitches:
-					for dbSwitch in dbSwitches:
-						if (switch.GetIp() in dbSwitch["ip"]):
-							dbSwitch["state"] = switch.GetState()
-							break
-				self.DB["switches"] = dbSwitches
+				for entry in self.Registry.GetEntries():
+					if entry.Device is not None:
+						entry.Record["state"] = entry.Device.GetState()
 				# Save new camera to database
-				self.Node.SetFileContent("db.json", json.dumps(self.DB))
+				self.Store.Save(self.DB)
 				self.SensorChange = 0
 		
-		if time.time() - self.SonoffDetectorTimestamp > 60 * 1:
-			# Scan network
-			devices = self.DeviceScanner.Scan("192.168.0.", [1,200])
-			print(devices)
-			
-			scanner 	= SonoffScanner()
-			ips 		= scanner.Scan(devices)
-			dbSwitches 	= self.DB["switches"]
-			
-			# Remove disconnected devices
-			for switch in self.ObjSwitches:
-				if (switch.GetIp() not in ips):
-					# Switch was disconnected
-					print ("DELETED <-------------------------->", switch.GetIp())
-					self.ObjSwitches.remove(switch)
-			
-			switchFound = False
-			saveToDB 	= False
-			# Append new devices
-			for ip in ips:
-				for switch in self.ObjSwitches:
-					if (switch.GetIp() in ip):
-						switchFound = True
-						# Noting to do
-						break
-						
-				if (switchFound is False):
-					# Append switch, but first check if it has record in DB
-					sonoff 	= Sonoff(ip)
-					id 		= sonoff.GetSwitchID()
-					sonoffFound = False
-					for itemSwitch in dbSwitches:
-						if id != "" and id in itemSwitch["id"]:
-							# Update DB with current IP
-							itemSwitch["ip"] = ip
-							sonoff.SetState(int(itemSwitch["state"]))
-							
-							if (sonoff.GetState == 0):
-								sonoff.SetSwitchOff()
-							else:
-								sonoff.SetSwitchOn()
-							
-							self.ObjSwitches.append(sonoff)
-							sonoffFound = True
-							saveToDB = True
-							print ("[Switch]>", "NodeSystemLoadedHandler - Switch UPDATED")
-							break
-					
-					if sonoffFound is False:
-						print ("[Switch]>", "NodeSystemLoadedHandler - NEW SWITCH")
-						# Append new switch.
-						dbSwitches.append({
-										'id': str(id),
-										'ip': str(ip),
-										'name': 'Switch_' + str(id),
-										'enable':1,
-										'mac': 'AA:AA:AA:AA:AA:AA',
-										'state': 0,
-										'status': 'connected'
-						})
-						self.ObjSwitches.append(switch)
-						saveToDB = True
-			
-			if (saveToDB is True):
-				self.DB["switches"] = dbSwitches
+		self.ApplyPolledStates()
+
+		# Update switches and local database with the background scans
+		for appended, removed in self.Discovery.GetResults():
+			appendedIps, removedIps = self.Reconciler.Apply(appended, removed)
+			self.RestoreStates()
+			if len(appendedIps) > 0 or len(removedIps) > 0:
+				print ("[Switch]>", "Rescan", appendedIps, removedIps)
 				# Save new switch to database
-				self.Node.SetFileContent("db.json", json.dumps(self.DB))
-			
-			self.SonoffDetectorTimestamp = time.time()
+				self.Store.Save(self.DB)
 			
 Service = MkSSlaveNode.SlaveNode()
 Node 	= MkSNode.Node("Sonoff Manager", Service)
 THIS 	= Context(Node)
 
 def signal_handler(signal, frame):
+	THIS.Discovery.Stop()
+	THIS.Poller.Stop()
 	THIS.Node.Stop()
 
 def main():
+	MkSLogger.Setup("sonoff")
 	signal.signal(signal.SIGINT, signal_handler)
 	THIS.Node.SetLocalServerStatus(True)
 	
@@ -524,6 +638,10 @@ def main():
 	THIS.Node.LocalServiceNode.OnCustomCommandResponseCallback		= THIS.OnCustomCommandResponseHandler
 	
 	THIS.Node.Run(THIS.WorkingHandler)
+	THIS.Discovery.Stop()
+	THIS.Poller.Stop()
+	THIS.Store.Close()
+	MkSLogger.Flush()
 	print ("Exit Node ...")
 
 if __name__ == "__main__":
@@ -0,0 +1,78 @@
+#!/usr/bin/python
+import threading
+from collections import deque
+
+# Versioned copy of the master local connections. Update() diffs a fresh
+# GetConnections() list against the table, every change bumps the version and
+# is kept in a bounded log so clients can ask for changes since the version
+# they already have instead of the full list.
+#
+#   OnChangesCallback(version, changes) 	- called from Update when something changed
+class ConnectionTable():
+	def __init__(self, log_size=256):
+		self.ObjName 			= "ConnectionTable"
+		self.Version 			= 0
+		self.Connections 		= {} # (ip, port) -> connection dict
+		self.Log 				= deque(maxlen=log_size) # (version, change)
+		self.Lock 				= threading.Lock()
+		self.OnChangesCallback 	= None
+
+	def Describe(self, item):
+		return {
+			'local_type':	item.LocalType,
+			'uuid':			item.UUID,
+			'ip':			item.IP,
+			'port':			item.Port,
+			'type':			item.Type
+		}
+
+	def Update(self, items):
+		current = {}
+		for item in items:
+			connection = self.Describe(item)
+			current[(connection["ip"], connection["port"])] = connection
+
+		changes = []
+		self.Lock.acquire()
+		for key, connection in current.items():
+			previous = self.Connections.get(key)
+			if previous is None:
+				changes.append({ 'event': 'connected', 'connection': connection })
+			elif previous != connection:
+				changes.append({ 'event': 'changed', 'connection': connection })
+		for key, connection in self.Connections.items():
+			if key not in current:
+				changes.append({ 'event': 'disconnected', 'connection': connection })
+
+		for change in changes:
+			self.Version += 1
+			change['version'] = self.Version
+			self.Log.append((self.Version, change))
+		self.Connections 	= current
+		version 			= self.Version
+		self.Lock.release()
+
+		if len(changes) > 0 and self.OnChangesCallback is not None:
+			self.OnChangesCallback(version, changes)
+		return changes
+
+	# Returns (version, connections).
+	def GetConnections(self):
+		self.Lock.acquire()
+		connections = list(self.Connections.values())
+		version 	= self.Version
+		self.Lock.release()
+		return version, connections
+
+	# Returns (version, changes), changes is None when the log no longer
+	# reaches back to the given version and the full list must be fetched.
+	def GetChanges(self, since):
+		self.Lock.acquire()
+		try:
+			if since >= self.Version:
+				return self.Version, []
+			if since < 0 or len(self.Log) == 0 or self.Log[0][0] > since + 1:
+				return self.Version, None
+			return self.Version, [change for version, change in self.Log if version > since]
+		finally:
+			self.Lock.release()
@@ -0,0 +1,89 @@
+#!/usr/bin/python
+import time
+import array
+import threading
+
+# Fixed size ring of averaged samples at one resolution, one array per field.
+class TimeSeries():
+	def __init__(self, resolution, size, fields):
+		self.Resolution 	= resolution
+		self.Size 			= size
+		self.Fields 		= fields
+		self.Timestamps 	= array.array('d', [0.0] * size)
+		self.Values 		= dict((field, array.array('f', [0.0] * size)) for field in fields)
+		self.Head 			= 0 # Next slot to write
+		self.Count 			= 0
+		# Bucket being accumulated
+		self.Bucket 		= None
+		self.Sums 			= dict((field, 0.0) for field in fields)
+		self.Samples 		= 0
+
+	def Commit(self):
+		self.Timestamps[self.Head] = self.Bucket
+		for field in self.Fields:
+			self.Values[field][self.Head] = self.Sums[field] / self.Samples
+			self.Sums[field] = 0.0
+		self.Head 		= (self.Head + 1) % self.Size
+		self.Count 		= min(self.Count + 1, self.Size)
+		self.Samples 	= 0
+
+	def Add(self, timestamp, sample):
+		bucket = int(timestamp // self.Resolution) * self.Resolution
+		if bucket != self.Bucket and self.Samples > 0:
+			self.Commit()
+		self.Bucket = bucket
+		for field in self.Fields:
+			self.Sums[field] += float(sample[field])
+		self.Samples += 1
+
+	# Column oriented window [start, end], oldest first.
+	def Get(self, start, end):
+		window = { 'timestamps': [] }
+		for field in self.Fields:
+			window[field] = []
+		first = (self.Head - self.Count) % self.Size
+		for idx in range(self.Count):
+			slot = (first + idx) % self.Size
+			timestamp = self.Timestamps[slot]
+			if timestamp < start or timestamp > end:
+				continue
+			window['timestamps'].append(timestamp)
+			for field in self.Fields:
+				window[field].append(round(self.Values[field][slot], 1))
+		return window
+
+# Machine metrics history at several resolutions, fed by SystemMetrics samples.
+class MetricsHistory():
+	def __init__(self):
+		self.ObjName 	= "MetricsHistory"
+		self.Fields 	= ['cpu_usage', 'cpu_temperature', 'ram_used', 'hd_used']
+		self.Series 	= {
+			'second': 	TimeSeries(1, 	 15 * 60, 	self.Fields), # 15 minutes
+			'minute': 	TimeSeries(60, 	 24 * 60, 	self.Fields), # 1 day
+			'hour': 	TimeSeries(3600, 30 * 24, 	self.Fields)  # 30 days
+		}
+		self.Lock 		= threading.Lock()
+
+	def GetResolutions(self):
+		return self.Series.keys()
+
+	def Add(self, sample):
+		self.Lock.acquire()
+		for series in self.Series.values():
+			series.Add(sample["timestamp"], sample)
+		self.Lock.release()
+
+	# Returns None for an unknown resolution. Window defaults to everything kept.
+	def Get(self, resolution, start=None, end=None):
+		series = self.Series.get(resolution)
+		if series is None:
+			return None
+		if start is None:
+			start = 0
+		if end is None:
+			end = time.time()
+		self.Lock.acquire()
+		window = series.Get(float(start), float(end))
+		self.Lock.release()
+		window['resolution'] = series.Resolution
+		return window
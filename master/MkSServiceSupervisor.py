@@ -0,0 +1,204 @@
+#!/usr/bin/python
+import os
+import time
+import signal
+import logging
+import threading
+import subprocess
+
+from mkscommon import MkSWakeEvent
+from mkscommon import MkSLogger
+
+LOG 	= logging.getLogger("master.supervisor")
+SAMPLED = MkSLogger.Sampled(LOG, 60)
+
+class ServiceProcess():
+	def __init__(self, service):
+		self.Service 		= service # services.json item
+		self.Process 		= None
+		self.State 			= "stopped" # stopped, running, backoff
+		self.StartTimestamp = 0
+		self.Restarts 		= 0
+		self.Backoff 		= 0
+		self.NextStart 		= 0
+		self.IsWanted 		= False
+
+	def GetPid(self):
+		if self.Process is None:
+			return 0
+		return self.Process.pid
+
+	def GetRSS(self):
+		pid = self.GetPid()
+		if 0 == pid:
+			return 0
+		try:
+			with open("/proc/" + str(pid) + "/status", "r") as status:
+				for line in status:
+					if line.startswith("VmRSS:"):
+						return int(line.split()[1])
+		except IOError:
+			pass
+		return 0
+
+# Starts on boot services, checks they are alive and restarts crashed ones
+# with exponential backoff. Every process change happens on the supervisor
+# thread, requests only mark services wanted or not.
+class ServiceSupervisor():
+	def __init__(self, path="../", check_interval=1, grace=5):
+		self.ObjName 		= "ServiceSupervisor"
+		self.Path 			= path
+		self.Command 		= ["python", "app.py"]
+		self.CheckInterval 	= check_interval
+		self.Grace 			= grace
+		# Restart backoff (seconds), reset once a service stayed up for StableAfter
+		self.MinBackoff 	= 1
+		self.MaxBackoff 	= 60
+		self.StableAfter 	= 60
+		self.Services 		= {}
+		self.Lock 			= threading.Lock()
+		self.IsRunning 		= False
+		self.WakeEvent 		= MkSWakeEvent.WakeEvent()
+
+	def Run(self):
+		if self.IsRunning is True:
+			return
+		self.IsRunning = True
+		worker = threading.Thread(target=self.SupervisorThread, name=self.ObjName)
+		worker.daemon = True
+		worker.start()
+
+	def Start(self, service):
+		self.Lock.acquire()
+		item = self.Services.get(service["uuid"])
+		if item is None:
+			item = ServiceProcess(service)
+			self.Services[service["uuid"]] = item
+		item.Service 	= service
+		item.IsWanted 	= True
+		item.Backoff 	= 0
+		item.NextStart 	= 0
+		self.Lock.release()
+		self.WakeEvent.set()
+
+	# Stop a single service without waiting for it, the grace period runs on
+	# its own thread so the caller (a node handler) is not blocked.
+	def Stop(self, uuid):
+		self.Lock.acquire()
+		item = self.Services.get(uuid)
+		if item is not None:
+			item.IsWanted = False
+		self.Lock.release()
+		if item is None:
+			return
+		worker = threading.Thread(target=self.Terminate, args=([item],), name=self.ObjName)
+		worker.daemon = True
+		worker.start()
+
+	def Launch(self, item):
+		LOG.info("[%s] Start service %s", self.ObjName, item.Service["name"])
+		try:
+			item.Process = subprocess.Popen(self.Command, cwd=os.path.join(self.Path, str(item.Service["type"])))
+		except OSError as e:
+			LOG.error("[%s] Exception %s %s", self.ObjName, item.Service["name"], e)
+			item.Process = None
+			self.ScheduleRestart(item)
+			return
+		item.State 			= "running"
+		item.StartTimestamp = time.time()
+
+	def ScheduleRestart(self, item):
+		item.State 		= "backoff"
+		item.Backoff 	= min(max(item.Backoff * 2, self.MinBackoff), self.MaxBackoff)
+		item.NextStart 	= time.time() + item.Backoff
+
+	def Check(self):
+		now = time.time()
+		self.Lock.acquire()
+		items = list(self.Services.values())
+		self.Lock.release()
+		for item in items:
+			if item.Process is not None and item.Process.poll() is not None:
+				LOG.warning("[%s] Service exited %s %s", self.ObjName, item.Service["name"], item.Process.returncode)
+				item.Process = None
+				if item.IsWanted is True:
+					if now - item.StartTimestamp > self.StableAfter:
+						item.Backoff = 0
+					item.Restarts += 1
+					self.ScheduleRestart(item)
+				else:
+					item.State = "stopped"
+
+			if item.IsWanted is True and item.Process is None and now >= item.NextStart:
+				self.Launch(item)
+
+	def SupervisorThread(self):
+		while self.IsRunning is True:
+			try:
+				self.Check()
+			except Exception as e:
+				SAMPLED.warning("check", "[%s] Exception %s", self.ObjName, e)
+			self.WakeEvent.wait(self.CheckInterval)
+			self.WakeEvent.clear()
+
+	# Ask all processes to exit at once (SIGINT, the nodes handle it), kill the
+	# ones still alive after the grace period.
+	def Terminate(self, items):
+		# Keep our own references, the supervisor thread may reap a process meanwhile
+		processes = []
+		for item in items:
+			process = item.Process
+			if process is not None and process.poll() is None:
+				try:
+					process.send_signal(signal.SIGINT)
+					processes.append((item, process))
+				except OSError:
+					pass
+			elif item.IsWanted is False:
+				item.Process 	= None
+				item.State 		= "stopped"
+
+		deadline = time.time() + self.Grace
+		while time.time() < deadline and any(process.poll() is None for item, process in processes):
+			time.sleep(0.1)
+
+		for item, process in processes:
+			if process.poll() is None:
+				LOG.warning("[%s] Kill service %s", self.ObjName, item.Service["name"])
+				try:
+					process.kill()
+				except OSError:
+					pass
+			process.wait()
+			if item.Process is process:
+				item.Process 	= None
+				item.State 		= "stopped"
+
+	def StopAll(self):
+		self.IsRunning = False
+		self.WakeEvent.set()
+		self.Lock.acquire()
+		items = list(self.Services.values())
+		for item in items:
+			item.IsWanted = False
+		self.Lock.release()
+		self.Terminate(items)
+
+	def GetInfo(self):
+		now = time.time()
+		self.Lock.acquire()
+		items = list(self.Services.values())
+		self.Lock.release()
+		info = []
+		for item in items:
+			running = item.Process is not None
+			info.append({
+				'uuid': 		item.Service["uuid"],
+				'name': 		item.Service["name"],
+				'state': 		item.State,
+				'pid': 			item.GetPid(),
+				'uptime': 		int(now - item.StartTimestamp) if running else 0,
+				'restarts': 	item.Restarts,
+				'rss_kb': 		item.GetRSS() if running else 0
+			})
+		return info
@@ -0,0 +1,132 @@
+#!/usr/bin/python
+import os
+import time
+import logging
+import threading
+import collections
+
+from mkscommon import MkSWakeEvent
+from mkscommon import MkSLogger
+
+LOG 	= logging.getLogger("master.metrics")
+SAMPLED = MkSLogger.Sampled(LOG, 60)
+
+# Samples machine metrics straight from /proc, /sys and statvfs on its own
+# thread. Requests read the latest sample, which is replaced as a whole so no
+# lock is needed on the reader side.
+class SystemMetrics():
+	def __init__(self, interval=2, history=300):
+		self.ObjName 			= "SystemMetrics"
+		self.Interval 			= interval
+		self.ThermalPath 		= "/sys/class/thermal/thermal_zone0/temp"
+		self.DiskPath 			= "/"
+		self.Samples 			= collections.deque(maxlen=history)
+		self.Latest 			= None
+		self.PrevCPUTimes 		= None
+		self.OnSampleCallback 	= None
+		self.IsRunning 			= False
+		self.WakeEvent 			= MkSWakeEvent.WakeEvent()
+
+		uname = os.uname()
+		self.Static = {
+			'os_type': 		uname[0],
+			'machine_name': uname[1],
+			'cpu_type': 	uname[4]
+		}
+
+	def Run(self):
+		if self.IsRunning is True:
+			return
+		self.IsRunning = True
+		self.Sample()
+		worker = threading.Thread(target=self.SamplerThread, name=self.ObjName)
+		worker.daemon = True
+		worker.start()
+
+	def Stop(self):
+		self.IsRunning = False
+		self.WakeEvent.set()
+
+	def GetLatest(self):
+		return self.Latest
+
+	def GetSamples(self):
+		return list(self.Samples)
+
+	def GetStatic(self):
+		return self.Static
+
+	# Busy percentage of all CPUs since the previous call.
+	def ReadCPUUsage(self):
+		with open("/proc/stat", "r") as stat:
+			cols = stat.readline().split()
+		times 	= [int(item) for item in cols[1:]]
+		idle 	= times[3] + (times[4] if len(times) > 4 else 0) # idle + iowait
+		total 	= sum(times)
+
+		usage = 0.0
+		if self.PrevCPUTimes is not None:
+			deltaTotal 	= total - self.PrevCPUTimes[0]
+			deltaIdle 	= idle - self.PrevCPUTimes[1]
+			if deltaTotal > 0:
+				usage = 100.0 * (deltaTotal - deltaIdle) / deltaTotal
+		self.PrevCPUTimes = (total, idle)
+		return round(usage, 1)
+
+	def ReadTemperature(self):
+		try:
+			with open(self.ThermalPath, "r") as thermal:
+				return round(float(thermal.read()) / 1000.0, 1)
+		except (IOError, ValueError):
+			return 0.0
+
+	# Returns (total, used, available) in MB.
+	def ReadMemory(self):
+		info = {}
+		with open("/proc/meminfo", "r") as meminfo:
+			for line in meminfo:
+				cols = line.split()
+				info[cols[0].rstrip(":")] = int(cols[1])
+		total = info.get("MemTotal", 0)
+		available = info.get("MemAvailable")
+		if available is None:
+			available = info.get("MemFree", 0) + info.get("Buffers", 0) + info.get("Cached", 0)
+		return total / 1024, (total - available) / 1024, available / 1024
+
+	# Returns (total, used, available) in GB.
+	def ReadDisk(self):
+		stat 		= os.statvfs(self.DiskPath)
+		total 		= stat.f_blocks * stat.f_frsize
+		available 	= stat.f_bavail * stat.f_frsize
+		used 		= (stat.f_blocks - stat.f_bfree) * stat.f_frsize
+		gb 			= 1024 * 1024 * 1024
+		return total / gb, used / gb, available / gb
+
+	def Sample(self):
+		ramTotal, ramUsed, ramAvailable = self.ReadMemory()
+		hdTotal, hdUsed, hdAvailable 	= self.ReadDisk()
+		sample = {
+			'timestamp': 		time.time(),
+			'cpu_usage': 		self.ReadCPUUsage(),
+			'cpu_temperature': 	self.ReadTemperature(),
+			'ram_total': 		ramTotal,
+			'ram_used': 		ramUsed,
+			'ram_available': 	ramAvailable,
+			'hd_total': 		hdTotal,
+			'hd_used': 			hdUsed,
+			'hd_available': 	hdAvailable
+		}
+		self.Samples.append(sample)
+		self.Latest = sample
+		if self.OnSampleCallback is not None:
+			self.OnSampleCallback(sample)
+
+	def SamplerThread(self):
+		while self.IsRunning is True:
+			self.WakeEvent.wait(self.Interval)
+			if self.IsRunning is False:
+				return
+			try:
+				self.Sample()
+			except Exception as e:
+				SAMPLED.warning("sample", "[%s] Exception %s", self.ObjName, e)
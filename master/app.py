@@ -6,6 +6,7 @@ import json
 import time
 import thread
 import threading
+import logging
 import re
 
 from mksdk import MkSGlobals
@@ -13,9 +14,19 @@ from mksdk import MkSFile
 from mksdk import MkSNode
 from mksdk import MkSMasterNode
 from mksdk import MkSShellExecutor
-from mksdk import MkSExternalProcess
 from mksdk import MkSUtils
 
+from mkscommon import MkSJSONStore
+from mkscommon import MkSCommandMetrics
+from mkscommon import MkSLogger
+
+import MkSSystemMetrics
+import MkSMetricsHistory
+import MkSServiceSupervisor
+import MkSConnectionTable
+
+LOG = logging.getLogger("master")
+
 class Context():
 	def __init__(self, node):
 		self.Interval			= 10
@@ -29,37 +40,94 @@ class Context():
 			'get_master_public_info':		self.GetMasterPublicInfoHandler,
 			'get_services_info': 			self.GetServicesInfoHandler,
 			'set_service_info': 			self.SetServiceInfoHandler,
+			'get_master_metrics_history':	self.GetMasterMetricsHistoryHandler,
+			'register_connections_events':	self.RegisterConnectionsEventsHandler,
+			'unregister_connections_events':self.UnregisterConnectionsEventsHandler,
+			'get_node_metrics':				self.GetNodeMetricsHandler,
 			'undefined':					self.UndefindHandler
 		}
 		# Handlers for local module (socket)
 		self.CustomRequestHandlers				= {
 			'get_connections_list':			self.GetConnectionsListRequestHandler,
 			'get_installed_nodes_list':		self.GetInstalledNodesListRequestHandler,
+			'get_node_metrics':				self.GetNodeMetricsRequestHandler,
 		}
+		self.CommandMetrics 	= MkSCommandMetrics.CommandMetrics()
+		self.CommandMetrics.Instrument(self.Handlers)
+		self.CommandMetrics.Instrument(self.CustomRequestHandlers)
 		self.CustomResponseHandlers				= {
 		}
 		self.InstalledNodesDB	= None
 		self.ServicesDB 		= None
-		self.RunningServices	= []
+		self.ServicesStore 		= MkSJSONStore.JSONStore(os.environ['HOME'] + "/mks/services.json")
+		self.Supervisor 		= MkSServiceSupervisor.ServiceSupervisor()
+		self.ConnectionTable 	= MkSConnectionTable.ConnectionTable()
+		self.ConnectionTable.OnChangesCallback = self.ConnectionsChangedHandler
+		# Register packets of clients listening to connection changes (by source)
+		self.ConnectionsSubscribers = {}
+		self.ConnectionsTimestamp 	= time.time()
+		# Connects and disconnects update the table from the socket events, the
+		# slow poll only catches connections changed by their handshake
+		self.ConnectionsInterval 	= 5
+		self.ConnectionsDirty 		= False
+		self.MetricsHistory 	= MkSMetricsHistory.MetricsHistory()
+		self.Metrics 			= MkSSystemMetrics.SystemMetrics(interval=1)
+		self.Metrics.OnSampleCallback = self.MetricsHistory.Add
+		self.Metrics.Run()
+		self.Supervisor.Run()
 
 	def UndefindHandler(self, packet):
 		print ("UndefindHandler")
 	
 	def GetConnectionsListRequestHandler(self, packet):
-		print ("GetConnectionsListRequestHandler")
+		LOG.debug("GetConnectionsListRequestHandler")
 		if THIS.Node.Network.GetNetworkState() is "CONN":
-			connections = []
-			for item in THIS.Node.LocalServiceNode.GetConnections():
-				connections.append({
-					'local_type':	item.LocalType,
-					'uuid':			item.UUID,
-					'ip':			item.IP,
-					'port':			item.Port,
-					'type':			item.Type
-				})
-			payload = {
-				'connections': connections
-			}
+			# Clients holding a version only get what changed since
+			since = packet["data"]["payload"].get("version")
+			changes = None
+			if since is not None:
+				version, changes = self.ConnectionTable.GetChanges(int(since))
+			if changes is not None:
+				payload = {
+					'version': version,
+					'changes': changes
+				}
+			else:
+				version, connections = self.ConnectionTable.GetConnections()
+				payload = {
+					'version': 		version,
+					'connections': 	connections
+				}
+			message = THIS.Node.Network.BuildResponse(packet, payload)
+			THIS.Node.Network.SendWebSocket(message)
+
+	# Changes are pushed as responses to the register request
+	def RegisterConnectionsEventsHandler(self, packet):
+		print ("RegisterConnectionsEventsHandler")
+		self.ConnectionsSubscribers[packet["header"]["source"]] = packet
+		version, connections = self.ConnectionTable.GetConnections()
+		payload = {
+			'version': 		version,
+			'connections': 	connections
+		}
+		message = THIS.Node.Network.BuildResponse(packet, payload)
+		THIS.Node.Network.SendWebSocket(message)
+
+	def UnregisterConnectionsEventsHandler(self, packet):
+		print ("UnregisterConnectionsEventsHandler")
+		self.ConnectionsSubscribers.pop(packet["header"]["source"], None)
+		payload = { 'error': 'ok' }
+		message = THIS.Node.Network.BuildResponse(packet, payload)
+		THIS.Node.Network.SendWebSocket(message)
+
+	def ConnectionsChangedHandler(self, version, changes):
+		if THIS.Node.Network.GetNetworkState() is not "CONN":
+			return
+		payload = {
+			'version': version,
+			'changes': changes
+		}
+		for packet in self.ConnectionsSubscribers.values():
 			message = THIS.Node.Network.BuildResponse(packet, payload)
 			THIS.Node.Network.SendWebSocket(message)
 
@@ -72,67 +140,10 @@ class Context():
 		THIS.Node.Network.SendWebSocket(message)
 	
 	def GetMasterPublicInfoHandler(self, packet):
-		print ("GetMasterPublicInfoHandler")
-		# Read
-		# 	Temperature						cat /sys/class/thermal/thermal_zone0/temp
-		#	CPU/RAM Usage, 10 Tasks List	top -n 1
-		#									ps -eo pcpu,pid,user,args | sort -k 1 -r | head -10
-		#
-		cpuUsage 		= 0
-		temperature 	= 0
-		ramTotal 		= 0
-		ramUsed 		= 0
-		hdTotal 		= 0
-		hdUsed 			= 0
-		hdAvailable 	= 0
-		osType 			= ""
-		boardType 		= ""
-		cpuType			= ""
-		shell = MkSShellExecutor.ShellExecutor()
-		
-		# Get CPU usage
-		data = shell.ExecuteCommand("ps -eo pcpu,pid,user,args | sort -k 1 -r | head -20")
-		data = re.sub(' +', ' ', data)
-		cmdRows = data.split("\n")
-		for row in cmdRows[1:-1]:
-			cols = row.split(" ")
-			if (cols[0] != ""):
-				cpuUsage += float(cols[0])
-			else:
-				cpuUsage += float(cols[1])
-		
-		# Get CPU temperature
-		data = shell.ExecuteCommand("cat /sys/class/thermal/thermal_zone0/temp")
-		temperature = float(float(data[:-3]) / 10.0)
-		
-		# Get RAM free space
-		data = shell.ExecuteCommand("free")
-		data = re.sub(' +', ' ', data)
-		cmdRows = data.split("\n")
-		col = cmdRows[1].split(" ")
-		ramTotal = int(col[1]) / 1023
-		ramUsed  = int(col[2]) / 1023
-		ramAvailable = ramTotal - ramUsed
-		
-		# Get CPU usage
-		data = shell.ExecuteCommand("df")
-		data = re.sub(' +', ' ', data)
-		cmdRows = data.split("\n")
-		for row in cmdRows[1:-1]:
-			cols = row.split(" ")
-			if (cols[5] == "/"):
-				hdTotal 		= int(cols[1]) / (1023 * 1023)
-				hdUsed 			= int(cols[2]) / (1023 * 1023)
-				hdAvailable 	= int(cols[3]) / (1023 * 1023)
-				break
-		
-		# Get OS info
-		data = shell.ExecuteCommand("uname -a")
-		data = re.sub(' +', ' ', data)
-		col = data.split(" ")
-		osType 		= col[0]
-		machineName = col[1]
-		cpuType		= col[11]
+		LOG.debug("GetMasterPublicInfoHandler")
+		# Machine metrics are sampled in the background, see MkSSystemMetrics
+		sample = self.Metrics.GetLatest()
+		static = self.Metrics.GetStatic()
 		
 		# Get network data
 		interfaces = []
@@ -151,28 +162,55 @@ class Context():
 			onBootServices = self.ServicesDB["on_boot_services"]
 
 		payload = {
-			'cpu_usage': str(cpuUsage),
-			'cpu_temperature': str(temperature),
-			'ram_total': str(ramTotal),
-			'ram_used': str(ramUsed),
-			'ram_available': str(ramAvailable),
-			'hd_total': str(hdTotal),
-			'hd_used': str(hdUsed),
-			'hd_available': str(hdAvailable),
-			'os_type': str(osType),
+			'cpu_usage': str(sample["cpu_usage"]),
+			'cpu_temperature': str(sample["cpu_temperature"]),
+			'ram_total': str(sample["ram_total"]),
+			'ram_used': str(sample["ram_used"]),
+			'ram_available': str(sample["ram_available"]),
+			'hd_total': str(sample["hd_total"]),
+			'hd_used': str(sample["hd_used"]),
+			'hd_available': str(sample["hd_available"]),
+			'os_type': str(static["os_type"]),
 			'board_type': str(THIS.Node.BoardType),
-			'cpu_type': str(cpuType),
-			'machine_name': str(machineName),
+			'cpu_type': str(static["cpu_type"]),
+			'machine_name': str(static["machine_name"]),
 			'network': network,
 			'on_boot_services': onBootServices,
 		}
 		message = THIS.Node.Network.BuildResponse(packet, payload)
 		THIS.Node.Network.SendWebSocket(message)
 	
+	# payload - { 'resolution': 'second' | 'minute' | 'hour', 'start': <unix time>, 'end': <unix time> }
+	def GetMasterMetricsHistoryHandler(self, packet):
+		print ("GetMasterMetricsHistoryHandler")
+		request 	= packet["data"]["payload"]
+		resolution 	= request.get("resolution", "minute")
+		history 	= self.MetricsHistory.Get(resolution, request.get("start"), request.get("end"))
+		if history is None:
+			payload = { 
+				'error': 'bad resolution',
+				'resolutions': self.MetricsHistory.GetResolutions()
+			}
+		else:
+			payload = {
+				'resolution': resolution,
+				'history': history
+			}
+		message = THIS.Node.Network.BuildResponse(packet, payload)
+		THIS.Node.Network.SendWebSocket(message)
+	
+	def GetNodeMetricsHandler(self, packet):
+		message = THIS.Node.Network.BuildResponse(packet, self.CommandMetrics.Get())
+		THIS.Node.Network.SendWebSocket(message)
+
+	def GetNodeMetricsRequestHandler(self, sock, packet):
+		THIS.Node.LocalServiceNode.SendCustomCommandResponse(sock, packet, self.CommandMetrics.Get())
+
 	def GetServicesInfoHandler(self, packet):
 		print ("GetServicesInfoHandler")
 		payload = {
 			'on_boot_services': self.ServicesDB["on_boot_services"],
+			'services': 		self.Supervisor.GetInfo()
 		}
 		message = THIS.Node.Network.BuildResponse(packet, payload)
 		THIS.Node.Network.SendWebSocket(message)
@@ -186,19 +224,23 @@ class Context():
 		for item in dbOnBootServices:
 			if (item["uuid"] == uuid):
 				item["enabled"] = enabled
+				# Apply now, other services and local connections are left alone
+				if (enabled == 1):
+					self.Supervisor.Start(item)
+				else:
+					self.Supervisor.Stop(uuid)
 				break
 		
 		self.ServicesDB["on_boot_services"] = dbOnBootServices
 		# Save new switch to database
-		MKS_PATH = os.environ['HOME'] + "/mks/"
-		self.Node.SetFileContent(MKS_PATH + "services.json", json.dumps(self.ServicesDB))
+		self.ServicesStore.Save(self.ServicesDB)
 		
 		payload = { 'error': 'ok' }
 		message = THIS.Node.Network.BuildResponse(packet, payload)
 		THIS.Node.Network.SendWebSocket(message)
 		
 	def OnCustomCommandRequestHandler(self, sock, packet):
-		print ("OnCustomCommandRequestHandler")
+		LOG.debug("OnCustomCommandRequestHandler %s", packet['command'])
 		command = packet['command']
 		if command in self.CustomRequestHandlers:
 			self.CustomRequestHandlers[command](sock, packet)
@@ -237,8 +279,8 @@ class Context():
 	
 	# Websockets
 	def WSDataArrivedHandler(self, packet):
-		print ("WSDataArrivedHandler")
 		command = packet['data']['header']['command']
+		LOG.debug("WSDataArrivedHandler %s", command)
 		self.Handlers[command](packet)
 	
 	def WSConnectedHandler(self):
@@ -246,6 +288,8 @@ class Context():
 
 	def WSConnectionClosedHandler(self):
 		print ("WSConnectionClosedHandler")
+		# Clients register again (and resync by version) once reconnected
+		self.ConnectionsSubscribers = {}
 
 	def NodeSystemLoadedHandler(self):
 		print ("NodeSystemLoadedHandler")
@@ -253,43 +297,56 @@ class Context():
 		
 		# Loading on master boot service database
 		MKS_PATH = os.environ['HOME'] + "/mks/"
-		jsonStr = self.Node.GetFileContent(MKS_PATH + "services.json")
-		if jsonStr != "":
-			self.ServicesDB = json.loads(jsonStr)
-			if (self.ServicesDB is not None):
-				services = self.ServicesDB["on_boot_services"]
-				for service in services:
-					if (service["enabled"] == 1):
-						print("START SERVCE", service["name"])
-						node = MkSExternalProcess.ExternalProcess()
-						self.RunningServices.append(node)
-						node.CallProcess("python app.py", "../" + str(service["type"]), "")
+		self.ServicesDB = self.ServicesStore.Load()
+		if (self.ServicesDB is not None):
+			services = self.ServicesDB["on_boot_services"]
+			for service in services:
+				if (service["enabled"] == 1):
+					print("START SERVCE", service["name"])
+					self.Supervisor.Start(service)
 		
 		# Load all installed nodes
 		jsonStr = self.Node.GetFileContent(MKS_PATH + "nodes.json")
 		if jsonStr != "":
 			self.InstalledNodesDB = json.loads(jsonStr)
 
+	def UpdateConnections(self):
+		self.ConnectionsDirty 		= False
+		self.ConnectionsTimestamp 	= time.time()
+		self.ConnectionTable.Update(THIS.Node.LocalServiceNode.GetConnections())
+
+	def OnAceptNewConnectionHandler(self, sock):
+		self.UpdateConnections()
+		# Read again on the next tick in case the list is updated after this event
+		self.ConnectionsDirty = True
+
+	def OnTerminateConnectionHandler(self, sock):
+		self.UpdateConnections()
+		self.ConnectionsDirty = True
+
 	def OnNodeWorkTick(self):
+		if self.ConnectionsDirty is True or time.time() - self.ConnectionsTimestamp > self.ConnectionsInterval:
+			self.UpdateConnections()
+
 		if time.time() - self.CurrentTimestamp > self.Interval:			
 			self.CheckingForUpdate = True
 			self.CurrentTimestamp = time.time()
 
 			for idx, item in enumerate(THIS.Node.LocalServiceNode.GetConnections()):
-				print ("  ", str(idx), item.LocalType, item.UUID, item.IP, item.Port, item.Type)
+				LOG.debug("  %s %s %s %s %s %s", idx, item.LocalType, item.UUID, item.IP, item.Port, item.Type)
 
 Service = MkSMasterNode.MasterNode()
 Node 	= MkSNode.Node("MASTER", Service)
 THIS 	= Context(Node)
 
 def signal_handler(signal, frame):
-	for service in THIS.RunningServices:
-		print("[Master] Stop service")
-		service.KillProcess()
-		time.sleep(2)
+	print("[Master] Stop services")
+	THIS.Supervisor.StopAll()
+	THIS.Metrics.Stop()
 	THIS.Node.Stop()
 
 def main():
+	MkSLogger.Setup("master")
 	signal.signal(signal.SIGINT, signal_handler)
 
 	THIS.Node.SetLocalServerStatus(True)
@@ -304,10 +361,14 @@ def main():
 	# Local service callbacks (TODO - please bubble these callbacks via Node)
 	THIS.Node.LocalServiceNode.OnCustomCommandRequestCallback		= THIS.OnCustomCommandRequestHandler
 	THIS.Node.LocalServiceNode.OnCustomCommandResponseCallback		= THIS.OnCustomCommandResponseHandler
+	THIS.Node.LocalServiceNode.OnAceptNewConnectionCallback			= THIS.OnAceptNewConnectionHandler
+	THIS.Node.LocalServiceNode.OnTerminateConnectionCallback 		= THIS.OnTerminateConnectionHandler
 
 	# Run Node
 	THIS.Node.Run(THIS.OnNodeWorkTick)
+	THIS.ServicesStore.Close()
 	
+	MkSLogger.Flush()
 	print ("Exit Node ...")
 
 if __name__ == "__main__":
@@ -0,0 +1,169 @@
+#!/usr/bin/python
+import time
+import logging
+import threading
+import Queue
+from collections import deque
+
+from mkscommon import MkSLogger
+
+LOG 	= logging.getLogger("dispatcher")
+SAMPLED = MkSLogger.Sampled(LOG, 10)
+
+class CommandLane():
+	def __init__(self, name, concurrency):
+		self.Name 			= name
+		self.Concurrency 	= concurrency
+		self.Running 		= 0
+		self.Waiting 		= deque() # (command, sock, packet, timestamp)
+		self.MaxWaiting 	= 0
+
+class CommandStatistics():
+	def __init__(self):
+		self.Calls 		= 0
+		self.Completed 	= 0 # Offloaded calls that ran
+		self.Rejected 	= 0
+		self.Errors 	= 0
+		self.WaitTotal 	= 0.0
+		self.WaitMax 	= 0.0
+
+# Runs custom command handlers (sock, packet) from a dispatch table. Commands
+# run inline on the local service thread unless offloaded, offloaded commands
+# run on a worker pool. Each offloaded command belongs to a lane (its own or
+# a shared group, e.g. commands using the same device) that caps how many run
+# at once, requests over the cap wait in the lane. Handlers answer on the
+# sock and packet they were called with, so responses still reach the
+# requesting socket.
+#
+#   OnCommandRejectedCallback(sock, packet) 	- lane is full, request dropped
+#   OnCommandFailedCallback(sock, packet) 		- offloaded handler raised, nothing was answered
+class CommandDispatcher():
+	def __init__(self, handlers, workers=4, lane_size=32, name="CommandDispatcher"):
+		self.ObjName 					= name
+		self.Handlers 					= handlers
+		self.LaneSize 					= lane_size
+		self.Lanes 						= {} # lane name -> CommandLane
+		self.CommandLanes 				= {} # command -> CommandLane
+		self.Statistics 				= {} # command -> CommandStatistics
+		self.Lock 						= threading.Lock()
+		self.Orders 					= Queue.Queue()
+		self.OnCommandRejectedCallback 	= None
+		self.OnCommandFailedCallback 	= None
+
+		for idx in range(workers):
+			worker = threading.Thread(target=self.WorkerThread, name=self.ObjName + "_" + str(idx))
+			worker.daemon = True
+			worker.start()
+
+	# Run command on the worker pool, at most concurrency at once per lane.
+	def Offload(self, command, concurrency=1, group=None):
+		name = command if group is None else group
+		self.Lock.acquire()
+		lane = self.Lanes.get(name)
+		if lane is None:
+			lane = CommandLane(name, concurrency)
+			self.Lanes[name] = lane
+		self.CommandLanes[command] = lane
+		self.Lock.release()
+
+	def GetCommandStatistics(self, command):
+		stats = self.Statistics.get(command)
+		if stats is None:
+			stats = CommandStatistics()
+			self.Statistics[command] = stats
+		return stats
+
+	# Returns False when there is no handler for the command.
+	def Dispatch(self, sock, packet):
+		command = packet['command']
+		handler = self.Handlers.get(command)
+		if handler is None:
+			return False
+
+		lane = self.CommandLanes.get(command)
+		if lane is None:
+			self.Lock.acquire()
+			self.GetCommandStatistics(command).Calls += 1
+			self.Lock.release()
+			handler(sock, packet)
+			return True
+
+		order 	 = (command, sock, packet, time.time())
+		rejected = False
+		self.Lock.acquire()
+		stats = self.GetCommandStatistics(command)
+		stats.Calls += 1
+		if lane.Running < lane.Concurrency:
+			lane.Running += 1
+			self.Orders.put(order)
+		elif len(lane.Waiting) < self.LaneSize:
+			lane.Waiting.append(order)
+			lane.MaxWaiting = max(lane.MaxWaiting, len(lane.Waiting))
+		else:
+			stats.Rejected += 1
+			rejected = True
+		self.Lock.release()
+
+		if rejected is True:
+			SAMPLED.warning("rejected " + command, "[%s] Rejected %s", self.ObjName, command)
+			if self.OnCommandRejectedCallback is not None:
+				self.OnCommandRejectedCallback(sock, packet)
+		return True
+
+	def WorkerThread(self):
+		while True:
+			command, sock, packet, timestamp = self.Orders.get(block=True, timeout=None)
+			wait  = time.time() - timestamp
+			error = False
+			try:
+				self.Handlers[command](sock, packet)
+			except Exception as e:
+				SAMPLED.warning("exception " + command, "[%s] Exception %s %s", self.ObjName, command, e)
+				error = True
+				if self.OnCommandFailedCallback is not None:
+					try:
+						self.OnCommandFailedCallback(sock, packet)
+					except Exception as e:
+						SAMPLED.warning("failed " + command, "[%s] Exception %s %s", self.ObjName, command, e)
+
+			lane = self.CommandLanes[command]
+			self.Lock.acquire()
+			stats = self.GetCommandStatistics(command)
+			stats.Completed += 1
+			stats.WaitTotal += wait
+			stats.WaitMax 	= max(stats.WaitMax, wait)
+			if error is True:
+				stats.Errors += 1
+			# Hand the slot to the next waiting request of the lane
+			if len(lane.Waiting) > 0:
+				self.Orders.put(lane.Waiting.popleft())
+			else:
+				lane.Running -= 1
+			self.Lock.release()
+
+	def GetStatistics(self):
+		self.Lock.acquire()
+		lanes = {}
+		for name, lane in self.Lanes.items():
+			lanes[name] = {
+				'concurrency': 	lane.Concurrency,
+				'running': 		lane.Running,
+				'waiting': 		len(lane.Waiting),
+				'max_waiting': 	lane.MaxWaiting
+			}
+		commands = {}
+		for command, stats in self.Statistics.items():
+			commands[command] = {
+				'offloaded': 	command in self.CommandLanes,
+				'calls': 		stats.Calls,
+				'rejected': 	stats.Rejected,
+				'errors': 		stats.Errors,
+				'wait_avg_ms': 	int((stats.WaitTotal / stats.Completed) * 1000) if stats.Completed > 0 else 0,
+				'wait_max_ms': 	int(stats.WaitMax * 1000)
+			}
+		self.Lock.release()
+		return {
+			'queued': 	self.Orders.qsize(),
+			'lanes': 	lanes,
+			'commands': commands
+		}
@@ -0,0 +1,117 @@
+#!/usr/bin/python
+import time
+import threading
+
+# Histogram bucket upper bounds (milliseconds), the last bucket is open
+LATENCY_BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000]
+
+class CommandCounter():
+	def __init__(self, now):
+		self.Calls 			= 0
+		self.Errors 		= 0
+		self.Total 			= 0.0
+		self.Max 			= 0.0
+		self.Buckets 		= [0] * (len(LATENCY_BUCKETS_MS) + 1)
+		# Calls of the current and previous minute, for throughput
+		self.Minute 		= int(now // 60)
+		self.MinuteCalls 	= 0
+		self.LastMinuteCalls = 0
+
+	def Add(self, now, latency, error):
+		minute = int(now // 60)
+		if minute != self.Minute:
+			self.LastMinuteCalls 	= self.MinuteCalls if minute == self.Minute + 1 else 0
+			self.MinuteCalls 		= 0
+			self.Minute 			= minute
+		self.MinuteCalls += 1
+
+		self.Calls += 1
+		if error is True:
+			self.Errors += 1
+		self.Total 	+= latency
+		self.Max 	= max(self.Max, latency)
+
+		latencyMs = latency * 1000
+		index = 0
+		while index < len(LATENCY_BUCKETS_MS) and latencyMs > LATENCY_BUCKETS_MS[index]:
+			index += 1
+		self.Buckets[index] += 1
+
+	# Upper bound of the bucket holding the given quantile.
+	def Percentile(self, quantile):
+		rank = quantile * self.Calls
+		count = 0
+		for index, bucket in enumerate(self.Buckets):
+			count += bucket
+			if count >= rank and count > 0:
+				if index < len(LATENCY_BUCKETS_MS):
+					return LATENCY_BUCKETS_MS[index]
+				return int(self.Max * 1000)
+		return 0
+
+# Per command call counters and latency histograms. Instrument() wraps a
+# handler table in place, so the node dispatch code (websocket handlers,
+# custom commands, dispatcher pool) is measured without changing it.
+class CommandMetrics():
+	def __init__(self):
+		self.ObjName 	= "CommandMetrics"
+		self.Counters 	= {}
+		self.Lock 		= threading.Lock()
+		self.Started 	= time.time()
+
+	def Add(self, command, latency, error):
+		now = time.time()
+		self.Lock.acquire()
+		counter = self.Counters.get(command)
+		if counter is None:
+			counter = CommandCounter(now)
+			self.Counters[command] = counter
+		counter.Add(now, latency, error)
+		self.Lock.release()
+
+	# Flask calls REST handlers with keyword arguments, they are passed through.
+	def Wrap(self, command, handler):
+		def Measured(*args, **kwargs):
+			start = time.time()
+			error = True
+			try:
+				result = handler(*args, **kwargs)
+				error = False
+				return result
+			finally:
+				self.Add(command, time.time() - start, error)
+		return Measured
+
+	# Replace every handler of the table with a measured one, returns the table.
+	def Instrument(self, handlers):
+		for command, handler in handlers.items():
+			handlers[command] = self.Wrap(command, handler)
+		return handlers
+
+	def Get(self):
+		now = time.time()
+		self.Lock.acquire()
+		commands = {}
+		for command, counter in self.Counters.items():
+			minute = int(now // 60)
+			if minute == counter.Minute:
+				lastMinute = counter.LastMinuteCalls
+			elif minute == counter.Minute + 1:
+				lastMinute = counter.MinuteCalls
+			else:
+				lastMinute = 0
+			commands[command] = {
+				'calls': 				counter.Calls,
+				'errors': 				counter.Errors,
+				'calls_last_minute': 	lastMinute,
+				'mean_ms': 				int((counter.Total / counter.Calls) * 1000) if counter.Calls > 0 else 0,
+				'max_ms': 				int(counter.Max * 1000),
+				'p50_ms': 				counter.Percentile(0.50),
+				'p95_ms': 				counter.Percentile(0.95),
+				'p99_ms': 				counter.Percentile(0.99)
+			}
+		self.Lock.release()
+		return {
+			'uptime': 	int(now - self.Started),
+			'commands': commands
+		}
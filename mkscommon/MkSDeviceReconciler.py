@@ -0,0 +1,76 @@
+#!/usr/bin/python
+import time
+
+# Reconciles a ping sweep against a DeviceRegistry. Attached devices that still
+# answer cost nothing, only addresses the registry does not know are
+# fingerprinted (in parallel on the scanner pool).
+#
+#   Fingerprint(ip) 				- returns device information or None if it is not our device
+#   OnDeviceAppend(ip, info) 		- a fingerprinted device was found (new or moved)
+#   OnDeviceRemove(entry) 			- an attached device stopped answering
+class DeviceReconciler():
+	def __init__(self, registry, scanner, fingerprint):
+		self.ObjName 			= "DeviceReconciler"
+		self.Registry 			= registry
+		self.Scanner 			= scanner
+		self.Fingerprint 		= fingerprint
+		self.OnDeviceAppend 	= None
+		self.OnDeviceRemove 	= None
+		# Addresses that answered ping but are not our devices, not fingerprinted again until expired
+		self.Rejected 			= {}
+		self.RejectedTimeout 	= 10 * 60
+
+	def IsRejected(self, ip, now):
+		timestamp = self.Rejected.get(ip)
+		if timestamp is None:
+			return False
+		if now - timestamp > self.RejectedTimeout:
+			del self.Rejected[ip]
+			return False
+		return True
+
+	# Compare a sweep with the registry without changing anything. Safe to call
+	# off the node thread. Returns ([(ip, info)], [entry]) to hand to Apply.
+	def Diff(self, ips):
+		now 	= time.time()
+		alive 	= set(ips)
+		known 	= {}
+		for entry in self.Registry.GetEntries():
+			if entry.Device is not None:
+				known[entry.Record["ip"]] = entry
+
+		removed 	= [entry for ip, entry in known.items() if ip not in alive]
+		candidates 	= [ip for ip in alive if ip not in known and self.IsRejected(ip, now) is False]
+		appended 	= []
+		if len(candidates) > 0:
+			results = self.Scanner.Map(candidates, self.Fingerprint)
+			for ip, info in zip(candidates, results):
+				if info is None:
+					self.Rejected[ip] = now
+					continue
+				self.Rejected.pop(ip, None)
+				appended.append((ip, info))
+
+		return appended, removed
+
+	# Emit the events of a Diff. Returns (appended ips, removed ips).
+	def Apply(self, appended, removed):
+		removedIps = []
+		# Removals go first so a device that moved is detached before it is appended again
+		for entry in removed:
+			if entry.Device is None:
+				continue
+			removedIps.append(entry.Record["ip"])
+			if self.OnDeviceRemove is not None:
+				self.OnDeviceRemove(entry)
+
+		for ip, info in appended:
+			if self.OnDeviceAppend is not None:
+				self.OnDeviceAppend(ip, info)
+
+		return [ip for ip, info in appended], removedIps
+
+	# Returns (appended ips, removed ips).
+	def Reconcile(self, ips):
+		appended, removed = self.Diff(ips)
+		return self.Apply(appended, removed)
@@ -0,0 +1,95 @@
+#!/usr/bin/python
+import threading
+
+class DeviceEntry():
+	def __init__(self, record, device=None):
+		self.Record = record # Database item, persisted
+		self.Device = device # Live object, None while the device is not found on the network
+
+# Devices of a node indexed by the given record keys (ip, mac, uid, id ...).
+# Records are the node database list itself, so changes made through the
+# registry are what gets saved.
+class DeviceRegistry():
+	def __init__(self, keys):
+		self.ObjName 	= "DeviceRegistry"
+		self.Keys 		= keys
+		self.Records 	= []
+		self.Entries 	= []
+		self.Indexes 	= dict((key, {}) for key in keys)
+		self.Lock 		= threading.RLock()
+
+	def Load(self, records):
+		self.Lock.acquire()
+		self.Records 	= records
+		self.Entries 	= []
+		self.Indexes 	= dict((key, {}) for key in self.Keys)
+		for record in records:
+			entry = DeviceEntry(record)
+			self.Entries.append(entry)
+			self.Index(entry)
+		self.Lock.release()
+
+	# Called with the lock held. Newer entries take the index slot of older ones.
+	def Index(self, entry):
+		for key in self.Keys:
+			value = entry.Record.get(key)
+			if value is not None and value != "":
+				self.Indexes[key][value] = entry
+
+	def Unindex(self, entry):
+		for key in self.Keys:
+			value = entry.Record.get(key)
+			if self.Indexes[key].get(value) is entry:
+				del self.Indexes[key][value]
+
+	def Add(self, record, device=None):
+		self.Lock.acquire()
+		entry = DeviceEntry(record, device)
+		self.Records.append(record)
+		self.Entries.append(entry)
+		self.Index(entry)
+		self.Lock.release()
+		return entry
+
+	def Remove(self, entry):
+		self.Lock.acquire()
+		self.Unindex(entry)
+		self.Entries.remove(entry)
+		self.Records.remove(entry.Record)
+		self.Lock.release()
+
+	def Find(self, key, value):
+		return self.Indexes[key].get(value)
+
+	# Live object registered under the given key, or None.
+	def FindDevice(self, key, value):
+		entry = self.Indexes[key].get(value)
+		if entry is None:
+			return None
+		return entry.Device
+
+	# Change an indexed record field, e.g. the IP of a device that moved.
+	def Update(self, entry, key, value):
+		self.Lock.acquire()
+		if self.Indexes[key].get(entry.Record.get(key)) is entry:
+			del self.Indexes[key][entry.Record.get(key)]
+		entry.Record[key] = value
+		self.Indexes[key][value] = entry
+		self.Lock.release()
+
+	def Attach(self, entry, device):
+		entry.Device = device
+
+	def Detach(self, entry):
+		device 			= entry.Device
+		entry.Device 	= None
+		return device
+
+	def GetEntries(self):
+		self.Lock.acquire()
+		entries = list(self.Entries)
+		self.Lock.release()
+		return entries
+
+	def GetDevices(self):
+		return [entry.Device for entry in self.GetEntries() if entry.Device is not None]
@@ -0,0 +1,44 @@
+#!/usr/bin/python
+import os
+import logging
+import subprocess
+
+from mkscommon import MkSWorkerPool
+from mkscommon import MkSLogger
+
+LOG 	= logging.getLogger("scanner")
+SAMPLED = MkSLogger.Sampled(LOG, 10)
+
+class DeviceScanner():
+	def __init__(self, workers=32, timeout=1):
+		self.ObjName 	= "DeviceScanner"
+		self.Timeout 	= timeout
+		self.Pool 		= MkSWorkerPool.WorkerPool(workers, self.ObjName)
+		self.DevNull 	= open(os.devnull, 'w')
+
+	def Ping(self, address):
+		try:
+			response = subprocess.call(["ping", "-c", "1", "-W", str(self.Timeout), address],
+					stdout=self.DevNull,
+					stderr=subprocess.STDOUT)
+		except OSError as e:
+			SAMPLED.warning("ping", "[%s] Exception %s", self.ObjName, e)
+			return False
+		# Check response
+		return 0 == response
+
+	# Run probe on every address using the worker pool, return the results in the same order.
+	def Map(self, addresses, probe, timeout=None):
+		return self.Pool.Map(probe, addresses, timeout)
+
+	# Run probe on every address using the worker pool, return addresses answered True.
+	def Probe(self, addresses, probe, timeout=None):
+		results = self.Map(addresses, probe, timeout)
+		return [address for address, res in zip(addresses, results) if res is True]
+
+	def Scan(self, network, index):
+		if (index[1] - index[0] < 0):
+			return []
+
+		addresses = [network + str(i) for i in range(index[0], index[1])]
+		return self.Probe(addresses, self.Ping)
@@ -0,0 +1,58 @@
+#!/usr/bin/python
+import random
+import logging
+import threading
+import Queue
+
+from mkscommon import MkSWakeEvent
+
+LOG = logging.getLogger("discovery")
+
+# Runs a discovery job on its own thread every Interval seconds (+/- Jitter),
+# the first run starts right away. Results are queued for the node thread,
+# which picks them up with GetResults() from its work tick.
+class DiscoveryScheduler():
+	def __init__(self, job, interval=60, jitter=0.2):
+		self.ObjName 	= "DiscoveryScheduler"
+		self.Job 		= job
+		self.Interval 	= interval
+		self.Jitter 	= jitter
+		self.Results 	= Queue.Queue()
+		self.IsRunning 	= False
+		self.WakeEvent 	= MkSWakeEvent.WakeEvent()
+
+	def Run(self):
+		if self.IsRunning is True:
+			return
+		self.IsRunning = True
+		worker = threading.Thread(target=self.SchedulerThread, name=self.ObjName)
+		worker.daemon = True
+		worker.start()
+
+	def Stop(self):
+		self.IsRunning = False
+		self.WakeEvent.set()
+
+	# Start the next run now instead of waiting for the interval.
+	def Trigger(self):
+		self.WakeEvent.set()
+
+	# Non blocking, returns every result published since the last call.
+	def GetResults(self):
+		results = []
+		while True:
+			try:
+				results.append(self.Results.get(block=False))
+			except Queue.Empty:
+				return results
+
+	def SchedulerThread(self):
+		while self.IsRunning is True:
+			try:
+				self.Results.put(self.Job())
+			except Exception as e:
+				LOG.exception("[%s] Exception %s", self.ObjName, e)
+
+			# Jitter keeps nodes started together from sweeping the network at the same moment
+			self.WakeEvent.wait(self.Interval * random.uniform(1 - self.Jitter, 1 + self.Jitter))
+			self.WakeEvent.clear()
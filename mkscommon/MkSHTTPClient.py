@@ -0,0 +1,187 @@
+#!/usr/bin/python
+import time
+import socket
+import base64
+import httplib
+import logging
+import threading
+import Queue
+
+from mkscommon import MkSLogger
+
+LOG 	= logging.getLogger("http")
+# Unreachable devices fail every request, one line per host and interval
+SAMPLED = MkSLogger.Sampled(LOG, 30)
+
+class LatencyStatistics():
+	def __init__(self):
+		self.Lock 		= threading.Lock()
+		self.Requests 	= 0
+		self.Errors 	= 0
+		self.Total 		= 0.0
+		self.Min 		= None
+		self.Max 		= 0.0
+		self.Last 		= 0.0
+		self.Average 	= 0.0 # Exponential moving average
+
+	def Add(self, latency, error):
+		self.Lock.acquire()
+		self.Requests += 1
+		if error is True:
+			self.Errors += 1
+		else:
+			self.Total 	+= latency
+			self.Last 	= latency
+			self.Max 	= max(self.Max, latency)
+			if self.Min is None or latency < self.Min:
+				self.Min = latency
+			if self.Average == 0.0:
+				self.Average = latency
+			else:
+				self.Average = 0.9 * self.Average + 0.1 * latency
+		self.Lock.release()
+
+	def Get(self):
+		self.Lock.acquire()
+		success = self.Requests - self.Errors
+		stats = {
+			'requests': 	self.Requests,
+			'errors': 		self.Errors,
+			'last_ms': 		int(self.Last * 1000),
+			'min_ms': 		int((self.Min or 0.0) * 1000),
+			'max_ms': 		int(self.Max * 1000),
+			'mean_ms': 		int((self.Total / success) * 1000) if success > 0 else 0,
+			'average_ms': 	int(self.Average * 1000)
+		}
+		self.Lock.release()
+		return stats
+
+# Keep-alive HTTP client for a single device. Connections are reused between
+# requests and Basic auth is sent with every request, so there is no 401 round trip.
+class HTTPClient():
+	def __init__(self, host, port=80, username=None, password=None, timeout=3, connections=2):
+		self.ObjName 		= "HTTPClient"
+		self.Host 			= host
+		self.Port 			= port
+		self.Timeout 		= timeout
+		self.Headers 		= { 'Connection': 'keep-alive' }
+		self.Idle 			= Queue.LifoQueue(connections)
+		self.Statistics 	= LatencyStatistics()
+		# Reconnect backoff (seconds)
+		self.MinBackoff 	= 1
+		self.MaxBackoff 	= 30
+		self.Backoff 		= 0
+		self.NextAttempt 	= 0
+
+		if username is not None:
+			self.Headers['Authorization'] = "Basic " + base64.b64encode(username + ":" + password)
+
+	def SetTimeout(self, timeout):
+		self.Timeout = timeout
+
+	def GetStatistics(self):
+		stats = self.Statistics.Get()
+		stats['backoff'] = self.Backoff
+		return stats
+
+	def Connect(self):
+		return httplib.HTTPConnection(self.Host, self.Port, timeout=self.Timeout)
+
+	def Acquire(self):
+		try:
+			return self.Idle.get(block=False), True
+		except Queue.Empty:
+			return self.Connect(), False
+
+	def Release(self, conn):
+		try:
+			self.Idle.put(conn, block=False)
+		except Queue.Full:
+			conn.close()
+
+	def Close(self):
+		while True:
+			try:
+				self.Idle.get(block=False).close()
+			except Queue.Empty:
+				return
+
+	def Failed(self):
+		self.Close()
+		self.Backoff 		= min(max(self.Backoff * 2, self.MinBackoff), self.MaxBackoff)
+		self.NextAttempt 	= time.time() + self.Backoff
+
+	def Request(self, conn, method, path, body, headers):
+		conn.request(method, path, body, headers)
+		response = conn.getresponse()
+		# Body must be fully read before the connection can be reused
+		data = response.read()
+		return response, data
+
+	# Returns (data, error) like the legacy urllib2 helpers did.
+	def Send(self, method, path, body=None, headers=None):
+		if time.time() < self.NextAttempt:
+			return "", True
+
+		allHeaders = dict(self.Headers)
+		if headers is not None:
+			allHeaders.update(headers)
+
+		start = time.time()
+		conn, reused = self.Acquire()
+		try:
+			try:
+				response, data = self.Request(conn, method, path, body, allHeaders)
+			except (httplib.HTTPException, socket.error):
+				if reused is False:
+					raise
+				# Device closed the idle keep-alive connection, retry once on a fresh one.
+				# The other idle connections are older, they are dropped as well.
+				conn.close()
+				self.Close()
+				conn = self.Connect()
+				response, data = self.Request(conn, method, path, body, allHeaders)
+		except (httplib.HTTPException, socket.error) as e:
+			SAMPLED.warning(self.Host, "[%s] Exception %s %s", self.ObjName, self.Host, e)
+			conn.close()
+			self.Failed()
+			self.Statistics.Add(time.time() - start, True)
+			return "", True
+
+		self.Backoff 		= 0
+		self.NextAttempt 	= 0
+		if response.will_close is True:
+			conn.close()
+		else:
+			self.Release(conn)
+
+		error = (response.status != 200)
+		self.Statistics.Add(time.time() - start, error)
+		return data, error
+
+	def Get(self, path, headers=None):
+		return self.Send("GET", path, None, headers)
+
+	# Open a long lived response (e.g. a multipart stream) on its own connection.
+	# Returns (connection, response) or (None, None), the caller owns both.
+	def Open(self, path, headers=None):
+		if time.time() < self.NextAttempt:
+			return None, None
+
+		allHeaders = dict(self.Headers)
+		if headers is not None:
+			allHeaders.update(headers)
+
+		conn = self.Connect()
+		try:
+			conn.request("GET", path, None, allHeaders)
+			response = conn.getresponse()
+		except (httplib.HTTPException, socket.error) as e:
+			SAMPLED.warning(self.Host, "[%s] Exception %s %s", self.ObjName, self.Host, e)
+			conn.close()
+			self.Failed()
+			return None, None
+
+		self.Backoff 		= 0
+		self.NextAttempt 	= 0
+		return conn, response
@@ -0,0 +1,99 @@
+#!/usr/bin/python
+import os
+import json
+import logging
+import threading
+
+LOG = logging.getLogger("store")
+
+# JSON document persisted with write-behind. Save() only marks the document
+# dirty, every change made within Delay seconds is written by one flush.
+# Files are written to a temporary file and renamed over the old one, so a
+# crash never leaves a half written database behind.
+class JSONStore():
+	def __init__(self, path, delay=1.0):
+		self.ObjName 	= "JSONStore"
+		self.Path 		= path
+		self.Delay 		= delay
+		self.Data 		= None
+		self.IsDirty 	= False
+		self.Timer 		= None
+		self.Lock 		= threading.RLock()
+		self.WriteLock 	= threading.Lock()
+
+	def Load(self, default=None):
+		self.Lock.acquire()
+		try:
+			with open(self.Path, "r") as dbFile:
+				content = dbFile.read()
+			self.Data = json.loads(content) if content != "" else default
+		except (IOError, ValueError) as e:
+			LOG.warning("[%s] Exception %s %s", self.ObjName, self.Path, e)
+			self.Data = default
+		self.IsDirty = False
+		self.Lock.release()
+		return self.Data
+
+	# Mark the document as changed and schedule a flush. When data is given it
+	# replaces the stored document.
+	def Save(self, data=None):
+		self.Lock.acquire()
+		if data is not None:
+			self.Data = data
+		self.IsDirty = True
+		if self.Timer is None:
+			self.Timer = threading.Timer(self.Delay, self.Flush)
+			self.Timer.daemon = True
+			self.Timer.start()
+		self.Lock.release()
+
+	# Serialized copy of the current document.
+	def Snapshot(self):
+		self.Lock.acquire()
+		try:
+			return json.dumps(self.Data)
+		finally:
+			self.Lock.release()
+
+	# Flushes are serialized from the snapshot on, so an older snapshot can
+	# never be written after a newer one.
+	def Flush(self):
+		self.WriteLock.acquire()
+		self.Lock.acquire()
+		self.Timer = None
+		if self.IsDirty is False:
+			self.Lock.release()
+			self.WriteLock.release()
+			return
+		try:
+			content = self.Snapshot()
+		except RuntimeError:
+			# Document changed under us by another thread, try again later
+			self.Lock.release()
+			self.WriteLock.release()
+			self.Save()
+			return
+		self.IsDirty = False
+		self.Lock.release()
+
+		tmpPath = self.Path + ".tmp"
+		try:
+			with open(tmpPath, "w") as dbFile:
+				dbFile.write(content)
+				dbFile.flush()
+				os.fsync(dbFile.fileno())
+			os.rename(tmpPath, self.Path)
+		except (IOError, OSError) as e:
+			LOG.warning("[%s] Exception %s %s", self.ObjName, self.Path, e)
+			self.Save()
+		finally:
+			self.WriteLock.release()
+
+	# Write pending changes now, call on node exit.
+	def Close(self):
+		self.Lock.acquire()
+		timer = self.Timer
+		self.Lock.release()
+		if timer is not None:
+			timer.cancel()
+		self.Flush()
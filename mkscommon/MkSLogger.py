@@ -0,0 +1,143 @@
+#!/usr/bin/python
+import os
+import sys
+import time
+import logging
+import logging.handlers
+import threading
+import Queue
+
+LOG_FORMAT 	= '%(asctime)s.%(msecs)03d %(levelname)s %(name)s - %(message)s'
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Hands records to the writer thread, never blocks the caller. Records that
+# do not fit the queue are dropped and counted.
+class QueueHandler(logging.Handler):
+	def __init__(self, queue):
+		logging.Handler.__init__(self)
+		self.Queue 		= queue
+		self.Dropped 	= 0
+
+	def emit(self, record):
+		try:
+			# Render now, arguments may change before the writer gets to them
+			record.msg 		= record.getMessage()
+			record.args 	= None
+			if record.exc_info:
+				record.exc_text = logging.Formatter().formatException(record.exc_info)
+				record.exc_info = None
+			self.Queue.put_nowait(record)
+		except Queue.Full:
+			self.Dropped += 1
+		except Exception:
+			self.handleError(record)
+
+class LogWriter():
+	def __init__(self, queue, handlers):
+		self.ObjName 	= "LogWriter"
+		self.Queue 		= queue
+		self.Handlers 	= handlers
+		worker = threading.Thread(target=self.WriterThread, name=self.ObjName)
+		worker.daemon = True
+		worker.start()
+
+	def WriterThread(self):
+		while True:
+			record = self.Queue.get(block=True, timeout=None)
+			for handler in self.Handlers:
+				if record.levelno >= handler.level:
+					handler.handle(record)
+
+	# Wait (bounded) for queued records to be written, call on node exit.
+	def Flush(self, timeout=2):
+		deadline = time.time() + timeout
+		while self.Queue.empty() is False and time.time() < deadline:
+			time.sleep(0.05)
+		for handler in self.Handlers:
+			handler.flush()
+
+# Lets one message per key through every Interval seconds, e.g. per frame or
+# per host traces. The next message that passes carries the suppressed count.
+class SampledLogger():
+	def __init__(self, logger, interval):
+		self.Logger 	= logger
+		self.Interval 	= interval
+		self.Keys 		= {} # key -> [last timestamp, suppressed]
+		self.Lock 		= threading.Lock()
+
+	def Log(self, level, key, msg, *args):
+		if self.Logger.isEnabledFor(level) is False:
+			return
+		now = time.time()
+		self.Lock.acquire()
+		state = self.Keys.get(key)
+		if state is not None and now - state[0] < self.Interval:
+			state[1] += 1
+			self.Lock.release()
+			return
+		suppressed = 0 if state is None else state[1]
+		self.Keys[key] = [now, 0]
+		self.Lock.release()
+		if suppressed > 0:
+			msg = msg + " (" + str(suppressed) + " similar suppressed)"
+		self.Logger.log(level, msg, *args)
+
+	def debug(self, key, msg, *args):
+		self.Log(logging.DEBUG, key, msg, *args)
+
+	def info(self, key, msg, *args):
+		self.Log(logging.INFO, key, msg, *args)
+
+	def warning(self, key, msg, *args):
+		self.Log(logging.WARNING, key, msg, *args)
+
+Writer = None
+
+def ParseLevel(name, default=logging.INFO):
+	return getattr(logging, str(name).upper(), default)
+
+# Configure the root logger of a node: records go through a bounded queue to a
+# size rotated file ($HOME/mks/logs/<name>.log) and the console. Levels can be
+# given per logger, MKS_LOG_LEVEL and MKS_LOG_LEVELS ("camera=debug,http=warning")
+# override them without code changes.
+def Setup(name, level="info", levels=None, console_level="info", max_bytes=1024 * 1024, backups=3, queue_size=10000):
+	global Writer
+	if Writer is not None:
+		return Writer
+
+	folder = os.path.join(os.environ.get('HOME', "."), "mks", "logs")
+	if os.path.exists(folder) is False:
+		os.makedirs(folder)
+	formatter = logging.Formatter(LOG_FORMAT, DATE_FORMAT)
+
+	fileHandler = logging.handlers.RotatingFileHandler(os.path.join(folder, name + ".log"), maxBytes=max_bytes, backupCount=backups)
+	fileHandler.setFormatter(formatter)
+	fileHandler.setLevel(logging.DEBUG)
+	consoleHandler = logging.StreamHandler(sys.stdout)
+	consoleHandler.setFormatter(formatter)
+	consoleHandler.setLevel(ParseLevel(console_level))
+
+	queue 	= Queue.Queue(queue_size)
+	Writer 	= LogWriter(queue, [fileHandler, consoleHandler])
+
+	root = logging.getLogger()
+	for handler in list(root.handlers):
+		root.removeHandler(handler)
+	root.addHandler(QueueHandler(queue))
+	root.setLevel(ParseLevel(os.environ.get("MKS_LOG_LEVEL", level)))
+
+	loggerLevels = dict(levels or {})
+	for item in os.environ.get("MKS_LOG_LEVELS", "").split(","):
+		if "=" in item:
+			logger, value = item.split("=", 1)
+			loggerLevels[logger.strip()] = value.strip()
+	for logger, value in loggerLevels.items():
+		logging.getLogger(logger).setLevel(ParseLevel(value))
+	return Writer
+
+def Sampled(logger, interval=10):
+	return SampledLogger(logger, interval)
+
+def Flush():
+	if Writer is not None:
+		Writer.Flush()
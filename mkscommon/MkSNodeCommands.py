@@ -0,0 +1,41 @@
+#!/usr/bin/python
+from mkscommon import MkSCommandDispatcher
+from mkscommon import MkSCommandMetrics
+
+# Custom command plumbing shared by the slave nodes. Both handler tables are
+# measured, custom commands go through a CommandDispatcher (see Offload) and
+# 'get_node_metrics' is added to the custom commands. A node sets it up with
+# one line after its handler tables and dispatches with Dispatch().
+class NodeCommands():
+	def __init__(self, node, handlers, custom_handlers, workers=4, lane_size=32):
+		self.ObjName 	= "NodeCommands"
+		self.Node 		= node
+		custom_handlers['get_node_metrics'] = self.GetNodeMetricsHandler
+		self.Metrics 	= MkSCommandMetrics.CommandMetrics()
+		self.Metrics.Instrument(handlers)
+		self.Metrics.Instrument(custom_handlers)
+		# Slow handlers run on the dispatcher pool instead of the local service thread
+		self.Dispatcher = MkSCommandDispatcher.CommandDispatcher(custom_handlers, workers, lane_size)
+		self.Dispatcher.OnCommandRejectedCallback = self.CommandRejectedHandler
+		self.Dispatcher.OnCommandFailedCallback = self.CommandFailedHandler
+
+	def Offload(self, command, concurrency=1, group=None):
+		self.Dispatcher.Offload(command, concurrency, group)
+
+	def Dispatch(self, sock, packet):
+		return self.Dispatcher.Dispatch(sock, packet)
+
+	def GetNodeMetricsHandler(self, sock, packet):
+		metrics = self.Metrics.Get()
+		metrics['dispatcher'] = self.Dispatcher.GetStatistics()
+		self.Node.LocalServiceNode.SendCustomCommandResponse(sock, packet, metrics)
+
+	def CommandRejectedHandler(self, sock, packet):
+		self.Node.LocalServiceNode.SendCustomCommandResponse(sock, packet, {
+			'error': 'busy'
+		})
+
+	def CommandFailedHandler(self, sock, packet):
+		self.Node.LocalServiceNode.SendCustomCommandResponse(sock, packet, {
+			'error': 'failed'
+		})
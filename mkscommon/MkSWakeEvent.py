@@ -0,0 +1,40 @@
+#!/usr/bin/python
+import os
+import select
+import threading
+
+# Stands in for threading.Event in worker loops that sleep until a deadline
+# or until they are woken. On Python 2 a timed Event.wait() polls, it sleeps
+# at most 50 ms at a time until the timeout. This one blocks in select() on
+# a pipe, the thread does not run until set() is called or the timeout ends.
+class WakeEvent():
+	def __init__(self):
+		self.Reader, self.Writer 	= os.pipe()
+		self.Lock 					= threading.Lock()
+		self.IsSet 					= False
+
+	def set(self):
+		self.Lock.acquire()
+		if self.IsSet is False:
+			self.IsSet = True
+			os.write(self.Writer, b"x")
+		self.Lock.release()
+
+	def clear(self):
+		self.Lock.acquire()
+		if self.IsSet is True:
+			self.IsSet = False
+			os.read(self.Reader, 1)
+		self.Lock.release()
+
+	def is_set(self):
+		return self.IsSet
+
+	# Returns True when the event is set, False on timeout.
+	def wait(self, timeout=None):
+		try:
+			readable, writable, failed = select.select([self.Reader], [], [], timeout)
+		except (select.error, OSError):
+			# Interrupted by a signal, callers loop and wait again
+			return self.IsSet
+		return len(readable) > 0
@@ -0,0 +1,71 @@
+#!/usr/bin/python
+import time
+import logging
+import threading
+import Queue
+
+from mkscommon import MkSLogger
+
+LOG 	= logging.getLogger("pool")
+# Failing items usually fail together (e.g. a whole sweep), keep one line per pool
+SAMPLED = MkSLogger.Sampled(LOG, 10)
+
+class WorkBatch():
+	def __init__(self, count):
+		self.Results 	= [None] * count
+		self.Pending 	= count
+		self.Condition 	= threading.Condition()
+
+	def Complete(self, index, result):
+		self.Condition.acquire()
+		self.Results[index] = result
+		self.Pending -= 1
+		if 0 == self.Pending:
+			self.Condition.notify_all()
+		self.Condition.release()
+
+	def Wait(self, timeout=None):
+		if timeout is not None:
+			deadline = time.time() + timeout
+		self.Condition.acquire()
+		while self.Pending > 0:
+			if timeout is None:
+				self.Condition.wait()
+			else:
+				remaining = deadline - time.time()
+				if remaining <= 0:
+					break
+				self.Condition.wait(remaining)
+		done = (0 == self.Pending)
+		self.Condition.release()
+		return done
+
+class WorkerPool():
+	def __init__(self, workers=16, name="WorkerPool"):
+		self.ObjName 	= name
+		self.Workers 	= workers
+		self.Orders 	= Queue.Queue()
+
+		for idx in range(self.Workers):
+			worker = threading.Thread(target=self.WorkerThread, name=self.ObjName + "_" + str(idx))
+			worker.daemon = True
+			worker.start()
+
+	def WorkerThread(self):
+		while True:
+			batch, index, func, item = self.Orders.get(block=True, timeout=None)
+			result = None
+			try:
+				result = func(item)
+			except Exception as e:
+				SAMPLED.warning(self.ObjName, "[%s] Exception %s", self.ObjName, e)
+			batch.Complete(index, result)
+
+	# Run func over every item on the pool and return the results in the same order.
+	# Items that did not finish before timeout are returned as None.
+	def Map(self, func, items, timeout=None):
+		batch = WorkBatch(len(items))
+		for index, item in enumerate(items):
+			self.Orders.put((batch, index, func, item))
+		batch.Wait(timeout)
+		return list(batch.Results)
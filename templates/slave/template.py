@@ -6,6 +6,7 @@ import json
 import time
 import thread
 import threading
+import logging
 
 from mksdk import MkSFile
 from mksdk import MkSNode
@@ -14,8 +15,13 @@ from mksdk import MkSLocalHWConnector
 from mksdk import MkSUSBAdaptor
 from mksdk import MkSProtocol
 
+from mkscommon import MkSNodeCommands
+from mkscommon import MkSLogger
+
 from flask import Response, request
 
+LOG = logging.getLogger("node")
+
 class Context():
 	def __init__(self, node):
 		self.Interval					= 10
@@ -30,6 +36,9 @@ class Context():
 		}
 		self.CustomRequestHandlers				= {
 		}
+		# Measured handlers, get_node_metrics and the dispatcher pool for slow handlers
+		self.Commands 							= MkSNodeCommands.NodeCommands(self.Node, self.Handlers, self.CustomRequestHandlers)
+		# e.g. self.Commands.Offload('command', concurrency=1) for handlers that block
 		self.CustomResponseHandlers				= {
 		}
 
@@ -78,10 +87,8 @@ class Context():
 		print "OnSetSensorInfoRequestHandler"
 	
 	def OnCustomCommandRequestHandler(self, sock, json_data):
-		print ("OnCustomCommandRequestHandler")
-		command = json_data['command']
-		if command in self.CustomRequestHandlers:
-			self.CustomRequestHandlers[command](sock, json_data)
+		LOG.debug("OnCustomCommandRequestHandler %s", json_data['command'])
+		self.Commands.Dispatch(sock, json_data)
 
 	def OnCustomCommandResponseHandler(self, sock, json_data):
 		print ("OnCustomCommandResponseHandler")
@@ -133,6 +140,7 @@ def signal_handler(signal, frame):
 	THIS.Node.Stop()
 
 def main():
+	MkSLogger.Setup("node")
 	signal.signal(signal.SIGINT, signal_handler)
 	THIS.Node.SetLocalServerStatus(True)
 	
@@ -157,6 +165,7 @@ def main():
 	THIS.Node.LocalServiceNode.OnCustomCommandResponseCallback		= THIS.OnCustomCommandResponseHandler
 	
 	THIS.Node.Run(THIS.WorkingHandler)
+	MkSLogger.Flush()
 	print "Exit Node ..."
 
 if __name__ == "__main__":